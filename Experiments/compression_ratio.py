@@ -4,6 +4,14 @@ from scipy.stats import pearsonr
 from Experiments.utils import log_stats
 from pathlib import Path
 
+def _encode_or_skip(tokenizer, sample):
+    try:
+        return tokenizer.encode(sample)
+    except Exception as e:
+        print(f"Error processing story: {e}")
+        return None
+
+
 def compression_ratio(tokenizer, text_samples, path, corpus_name="TinyStories"):
 
     compression_ratios = []
@@ -12,27 +20,27 @@ def compression_ratio(tokenizer, text_samples, path, corpus_name="TinyStories"):
     token_ids = []
     byte_level_ratios = []
 
-    for sample in text_samples:
-        try:
-            bytes_i = len(sample.encode('utf-8', errors='ignore'))
-            if bytes_i == 0:
-                continue
+    # One bad sample fails the whole batch, it is then encoded sample by sample so only bad ones are skipped.
+    # Leaving the context closes the worker pool, so repeated experiments do not keep idle workers around.
+    try:
+        with tokenizer:
+            encoded_samples = tokenizer.encode_batch(text_samples)
+    except Exception:
+        encoded_samples = [_encode_or_skip(tokenizer, sample) for sample in text_samples]
 
-            tokens_i = tokenizer.encode(sample)
-            token_count = len(tokens_i)
-            if token_count == 0:
-                continue
-            compression_ratio_i = bytes_i / token_count
-            compression_ratios.append(compression_ratio_i)
-            byte_lengths.append(bytes_i)
-            token_counts.append(token_count)
-            token_ids.append(tokens_i)
+    for sample, tokens_i in zip(text_samples, encoded_samples):
+        bytes_i = len(sample.encode('utf-8', errors='ignore'))
+        if bytes_i == 0 or not tokens_i:
+            continue
 
-            byte_level_ratios.append(1.0)
+        token_count = len(tokens_i)
+        compression_ratio_i = bytes_i / token_count
+        compression_ratios.append(compression_ratio_i)
+        byte_lengths.append(bytes_i)
+        token_counts.append(token_count)
+        token_ids.append(tokens_i)
 
-        except Exception as e:
-            print(f"Error processing story: {e}")
-            continue
+        byte_level_ratios.append(1.0)
 
     compression_ratios = np.array(compression_ratios)
     output_path =  path / f"compression_ratio_experiment/{corpus_name}"
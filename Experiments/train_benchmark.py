@@ -0,0 +1,246 @@
+import hashlib
+import importlib
+import multiprocessing as mp
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from queue import Empty
+
+import numpy as np
+
+from Experiments.utils import log_stats
+
+if sys.platform != "win32":
+    import resource
+
+TRAINERS = {
+    "optimized": "Tokenizer.BPE_Tokenizer_Optimized",
+    "unoptimized": "Tokenizer.BPE_Tokenizer_Unoptimized",
+}
+FIXTURE_CORPORA = {
+    "corpus.en": Path("tests/fixtures/corpus.en"),
+    "tinystories_sample": Path("tests/fixtures/tinystories_sample.txt"),
+}
+SYNTHETIC_SEED = 2024
+SYNTHETIC_VOCAB_WORDS = 50_000
+SYNTHETIC_BLOCK_WORDS = 1_000_000
+SEPARATORS = {".": 0.05, ",": 0.04, "!": 0.005, "\n": 0.01, "\n<|endoftext|>\n": 0.004}
+
+
+def _synthetic_words(rng) -> list[str]:
+    lengths = rng.integers(1, 12, size=SYNTHETIC_VOCAB_WORDS)
+    letters = rng.integers(ord("a"), ord("z") + 1, size=int(lengths.sum())).astype(np.uint8).tobytes().decode()
+    words, position = [], 0
+    for length in lengths.tolist():
+        words.append(letters[position:position + length])
+        position += length
+    for i in rng.choice(len(words), size=len(words) // 10, replace=False).tolist():
+        words[i] = words[i].capitalize()
+    words += [str(number) for number in rng.integers(0, 10_000, size=500).tolist()]
+    words += ["café", "naïve", "über", "größe", "東京", "привет"]
+    return words
+
+
+def synthetic_corpus(path: str | Path, size_bytes: int, seed: int = SYNTHETIC_SEED) -> Path:
+    """
+    Write a deterministic corpus of exactly `size_bytes` bytes: Zipf-distributed synthetic
+    words with punctuation, line breaks and <|endoftext|>-separated documents.
+    The same size and seed always produce the same file, so it is only written once.
+    """
+    path = Path(path)
+    if path.exists() and path.stat().st_size == size_bytes:
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    words = _synthetic_words(rng)
+    weights = 1.0 / np.arange(1, len(words) + 1) ** 1.1
+    weights *= (1.0 - sum(SEPARATORS.values())) / weights.sum()
+    words += list(SEPARATORS)
+    weights = np.concatenate([weights, list(SEPARATORS.values())])
+    weights /= weights.sum()
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    written = 0
+    with open(tmp_path, "wb") as f:
+        while written < size_bytes:
+            ids = rng.choice(len(words), size=SYNTHETIC_BLOCK_WORDS, p=weights)
+            text = " ".join([words[i] for i in ids.tolist()])
+            for separator in SEPARATORS:
+                text = text.replace(" " + separator, separator)
+            text = text.replace("\n ", "\n")
+            block = text.encode("utf-8")
+            remaining = size_bytes - written
+            if len(block) > remaining:
+                # Cut on a character boundary and pad, so the file size is exact.
+                block = block[:remaining].decode("utf-8", errors="ignore").encode("utf-8")
+                block += b" " * (remaining - len(block))
+            f.write(block)
+            written += len(block)
+    tmp_path.replace(path)
+    return path
+
+
+def _peak_rss_bytes(children: bool = False) -> int:
+    # ru_maxrss survives exec, so a spawned child would report its parent's peak. VmHWM starts afresh.
+    if not children:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    if sys.platform == "win32":
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_trainer(trainer, corpus_path, vocab_size, special_tokens, train_kwargs, queue):
+    module = importlib.import_module(TRAINERS[trainer])
+    kwargs = dict(train_kwargs)
+    phases = defaultdict(float)
+    if trainer == "optimized":
+        from Tokenizer.training_metrics import TrainingMetrics
+
+        def record(event):
+            if event["event"] == "phase":
+                phases[event["phase"]] += event["seconds"]
+
+        kwargs["metrics"] = TrainingMetrics(callback=record)
+
+    start = time.perf_counter()
+    vocab, merges = module.train_bpe(str(corpus_path), vocab_size, special_tokens, **kwargs)
+    seconds = time.perf_counter() - start
+
+    # The unoptimized trainer never fills in its merge list, an empty hash would prove nothing about it.
+    merges_digest = hashlib.sha256() if merges else None
+    for left, right in merges:
+        merges_digest.update(len(left).to_bytes(4, "little") + left + len(right).to_bytes(4, "little") + right)
+    merging_seconds = phases.get("merging")
+    queue.put({
+        "seconds": seconds,
+        "phases": dict(phases),
+        "vocab_size": len(vocab),
+        "num_merges": len(merges),
+        "merges_per_second": len(merges) / merging_seconds if merging_seconds else None,
+        "merges_sha256": merges_digest.hexdigest() if merges_digest else None,
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "peak_worker_rss_bytes": _peak_rss_bytes(children=True),
+    })
+
+
+def benchmark_run(trainer: str,
+                  corpus_path: str | Path,
+                  vocab_size: int,
+                  special_tokens: list[str],
+                  **train_kwargs) -> dict:
+    """
+    Train once in a fresh spawned process, so peak RSS belongs to this run alone and no
+    import or page cache state of the benchmark process leaks into it.
+    """
+    context = mp.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_trainer,
+                              args=(trainer, corpus_path, vocab_size, special_tokens, train_kwargs, queue))
+    process.start()
+    # Read before joining, a child blocked on a full pipe would never exit.
+    result = {}
+    while not result:
+        # Checked before waiting, anything a finished child put is already in the pipe.
+        alive = process.is_alive()
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            if not alive:
+                break
+    process.join()
+    if process.exitcode != 0 and not result:
+        result = {"error": f"trainer exited with code {process.exitcode}"}
+    return {"trainer": trainer, "corpus": Path(corpus_path).name, "corpus_bytes": Path(corpus_path).stat().st_size,
+            "target_vocab_size": vocab_size, **result}
+
+
+def run_benchmarks(corpora: dict[str, Path],
+                   vocab_size: int,
+                   special_tokens: list[str],
+                   trainers: list[str] = ("optimized", "unoptimized"),
+                   unoptimized_max_bytes: int = 1024 * 1024,
+                   repeats: int = 1,
+                   **train_kwargs) -> list[dict]:
+    results = []
+    for name, corpus_path in corpora.items():
+        for trainer in trainers:
+            # The unoptimized trainer recounts every pair on every merge, large corpora would never finish.
+            if trainer == "unoptimized" and Path(corpus_path).stat().st_size > unoptimized_max_bytes:
+                continue
+            kwargs = train_kwargs if trainer == "optimized" else {}
+            for repeat in range(repeats):
+                result = benchmark_run(trainer, corpus_path, vocab_size, special_tokens, **kwargs)
+                result.update(corpus=name, repeat=repeat)
+                results.append(result)
+                print(f"{name:>24} {trainer:>12} #{repeat}: "
+                      + (result["error"] if "error" in result else
+                         f"{result['seconds']:8.2f}s  peak RSS {result['peak_rss_bytes'] / 2 ** 20:8.1f} MB"))
+    return results
+
+
+def _best_runs(results: list[dict]) -> dict:
+    # The fastest repeat is the least noisy estimate of what the code can do.
+    best = {}
+    for result in results:
+        if "error" in result:
+            continue
+        key = (result["corpus"], result["trainer"], result["target_vocab_size"])
+        if key not in best or result["seconds"] < best[key]["seconds"]:
+            best[key] = result
+    return best
+
+
+def compare_with_baseline(results: list[dict], baseline: list[dict], tolerance: float = 0.1) -> list[dict]:
+    """
+    Compare every (corpus, trainer, vocab size) present in both result sets. A run regresses
+    when it is more than `tolerance` slower or larger in peak RSS, or when its merges changed.
+    Merges are only compared for runs that recorded them, merges_changed is None otherwise.
+    """
+    current, previous = _best_runs(results), _best_runs(baseline)
+    comparisons = []
+    for key in sorted(current.keys() & previous.keys()):
+        now, before = current[key], previous[key]
+        time_ratio = now["seconds"] / before["seconds"]
+        rss_ratio = now["peak_rss_bytes"] / before["peak_rss_bytes"] if before["peak_rss_bytes"] else 1.0
+        merges_changed = (now["merges_sha256"] != before["merges_sha256"]
+                          if now["merges_sha256"] and before["merges_sha256"] else None)
+        comparisons.append({
+            "corpus": key[0], "trainer": key[1], "target_vocab_size": key[2],
+            "time_ratio": time_ratio, "rss_ratio": rss_ratio, "merges_changed": merges_changed,
+            "regression": time_ratio > 1 + tolerance or rss_ratio > 1 + tolerance or bool(merges_changed),
+        })
+    return comparisons
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_benchmark(results: list[dict], output_path: Path, comparisons: list[dict] | None = None):
+    Path.mkdir(output_path, parents=True, exist_ok=True)
+    stats = {
+        "git_commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpu_count": mp.cpu_count(),
+        "results": results,
+    }
+    if comparisons is not None:
+        stats["comparisons"] = comparisons
+    log_stats(stats, output_path)
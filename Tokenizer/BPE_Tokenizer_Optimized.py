@@ -1 +1 @@
-import osimport regex as refrom collections import Counter, defaultdictfrom Tokenizer.pre_tokenization_chunks import find_chunk_boundariesimport multiprocessing as mpfrom pathlib import Pathdef pre_tokenization(training_data, special_tokens):    # This is taken from github.com/openai/tiktoken/pull/234/files (GPT2)    PAT = r"""'(?:[sdmt]|ll|ve|re)| ?\p{N}+| ?\p{L}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""    if not special_tokens:        return [m.group() for m in re.finditer(PAT, training_data)]    escaped_list = [re.escape(special_token) for special_token in special_tokens]    split_PAT = r"({})".format("|".join(escaped_list))    split_corpus = re.split(split_PAT, training_data)    pretokenized_train_data = []    for segment in split_corpus:        token_list = [special_token for special_token in special_tokens if special_token in segment]        if not segment:            continue        if len(token_list) >= 1:            pretokenized_train_data.append(segment)        else:            for m in re.finditer(PAT, segment):                yield m.group()def process_chunk(file_path, start, end, special_tokens):    with open(file_path, "rb") as f:        f.seek(start)        text = f.read(end - start).decode("utf-8",                                          errors="surrogateescape")        tokens_generator = pre_tokenization(text, special_tokens)        counts = Counter(tokens_generator)        del text        del tokens_generator        print(f"\nprocessed {sum(counts.values())} tokens")        return countsdef get_best_pair(potential_merges: dict, token_str: dict):    max_freq = max(potential_merges.values())    candidate_pairs = [pair for pair, freq in potential_merges.items() if freq == max_freq]    best_pair = max(        candidate_pairs,        key=lambda pair: (token_str[pair[0]], token_str[pair[1]]))    return best_pairdef word_merge(word_tuple, best_pair, new_token_id):    new_word_list = []    k = 0    while k < len(word_tuple):        if k < len(word_tuple) - 1 and (word_tuple[k], word_tuple[k + 1]) == best_pair:            new_word_list.append(new_token_id)            k += 2        else:            new_word_list.append(word_tuple[k])            k += 1    new_word_tuple = tuple(new_word_list)    return new_word_tupledef decrement_counts(word_tuple, potential_merges, bigram_locations, count):    for j in range(len(word_tuple) - 1):        bigram = (word_tuple[j], word_tuple[j + 1])        potential_merges[bigram] -= count        if bigram in bigram_locations and word_tuple in bigram_locations[bigram]:            bigram_locations[bigram][word_tuple].discard(j)            if not bigram_locations[bigram][word_tuple]:                del bigram_locations[bigram][word_tuple]        if potential_merges[bigram] <= 0:            del potential_merges[bigram]def increment_counts(new_word_tuple, potential_merges, bigram_locations, count):    for j in range(len(new_word_tuple) - 1):        bigram = (new_word_tuple[j], new_word_tuple[j + 1])        potential_merges[bigram] += count        bigram_locations[bigram][new_word_tuple].add(j)def train_bpe(file_path: str | Path,              vocab_size: int,              special_tokens: list[str],              ):    merges = []    bigram_locations = defaultdict(lambda: defaultdict(set))    word_counts = Counter()    if not isinstance(special_tokens, list):        special_tokens = []    # reading file    print("\nFinding chunk boundaries")    chunk_size = 1024 * 1024 * 10  # 10MB chunks    file_size = os.path.getsize(file_path)    num_chunks = file_size // chunk_size + 1    with open(file_path, 'rb') as f:        boundaries = find_chunk_boundaries(f,                                           desired_num_chunks=num_chunks,                                           split_special_token=b"<|endoftext|>")    chunks = [(file_path, start, end, special_tokens) for start, end in zip(boundaries[:-1], boundaries[1:])]    print(f"\nStarting pre-tokenization of {len(chunks)} chunks")    with mp.Pool(processes=mp.cpu_count()) as pool:        results = pool.starmap(process_chunk, chunks)    for result in results:        word_counts.update(result)    vocab = {i: bytes([i]) for i in range(256)}    token_str = {i: chr(i) for i in range(256)}    print("\nStating the training process")    for i, token in enumerate(special_tokens):        vocab[256 + i] = token.encode("utf-8")    constructed_vocab = {}    for word, count in word_counts.items():        if word in special_tokens:            continue        constructed_vocab[tuple(word.encode("utf-8"))] = count    potential_merges = defaultdict(int)    for word_tuple, count in constructed_vocab.items():        for i in range(len(word_tuple) - 1):            bigram = (word_tuple[i], word_tuple[i + 1])            potential_merges[bigram] += count            bigram_locations[bigram][word_tuple].add(i)    # --- The Merging Loop ---    num_merges = vocab_size - len(vocab)    for i in range(num_merges):        if not potential_merges:            print("No more pairs to merge. Stopping early.")            break        best_pair = get_best_pair(potential_merges, token_str)        new_token_id = 256 + len(special_tokens) + i        merges.append(best_pair)        vocab[new_token_id] = vocab[best_pair[0]] + vocab[best_pair[1]]        token_str[new_token_id] = token_str[best_pair[0]] + token_str[best_pair[1]]        words_affected = list(bigram_locations[best_pair].keys())        for word_tuple in words_affected:            if word_tuple not in constructed_vocab:                continue            count = constructed_vocab[word_tuple]            # Decrement stats for all bigrams in the OLD word.            decrement_counts(word_tuple, potential_merges, bigram_locations, count)            # Merging            new_word_tuple = word_merge(word_tuple, best_pair, new_token_id)            constructed_vocab[new_word_tuple] = count            # Increment stats for all bigrams in the NEW word.            increment_counts(new_word_tuple, potential_merges, bigram_locations, count)            del constructed_vocab[word_tuple]        # Clean up the best_pair from bigram_locations (it should already be empty, but just to be safe)        if best_pair in bigram_locations:            del bigram_locations[best_pair]    readable_merges = [(vocab[p1], vocab[p2]) for p1, p2 in merges]    return vocab, readable_merges
\ No newline at end of file
+import gcimport osimport heapqimport mmapimport pickleimport timefrom array import arrayfrom bisect import bisect_leftimport numpy as npimport regex as refrom collections import Counter, defaultdict, dequefrom Tokenizer.pre_tokenization_chunks import find_chunk_boundariesfrom Tokenizer.pre_token_counts import (corpus_fingerprint, counts_cache_path, load_counts, merge_packed_counts,                                        pack_counts, save_counts)from Tokenizer.training_metrics import MergeProgress, TrainingMetricsimport multiprocessing as mpfrom contextlib import contextmanagerfrom pathlib import Path# This is taken from github.com/openai/tiktoken/pull/234/files (GPT2)PAT = r"""'(?:[sdmt]|ll|ve|re)| ?\p{N}+| ?\p{L}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""DEFAULT_CHUNK_SIZE = 1024 * 1024 * 10  # 10MB chunksdef pre_tokenization(training_data, special_tokens):    if not special_tokens:        yield from (m.group() for m in re.finditer(PAT, training_data))        return    # Longest first, so that overlapping special tokens split on the longest match.    escaped_list = [re.escape(special_token) for special_token in sorted(special_tokens, key=len, reverse=True)]    split_PAT = r"({})".format("|".join(escaped_list))    split_corpus = re.split(split_PAT, training_data)    for segment in split_corpus:        if not segment:            continue        if segment in special_tokens:            yield segment        else:            for m in re.finditer(PAT, segment):                yield m.group()def process_chunk(file_path, start, end, special_tokens):    # The chunk is decoded straight out of the page cache, without first copying it into a bytes object.    # The pre-tokenizer itself needs str, its Unicode classes have no bytes-mode equivalent.    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:        with memoryview(mm) as view:            text = str(view[start:end], "utf-8", "surrogateescape")    counts = Counter(pre_tokenization(text, special_tokens))    del text    # Sent back packed as three flat arrays of the original bytes, which pickle as raw buffers    # instead of one object per pre-token.    return pack_counts(counts)def process_chunk_args(args):    return process_chunk(*args)def process_text_batch(texts, special_tokens):    # Every item is pre-tokenized on its own, so no pre-token spans two documents.    counts = Counter()    for text in texts:        if isinstance(text, bytes):            text = text.decode("utf-8", "surrogateescape")        counts.update(pre_tokenization(text, special_tokens))    return pack_counts(counts)class TokenRanks:    """    Integer labels that order exactly like the token bytes, so pair ties are broken with a    couple of integer comparisons instead of comparing ever longer strings. Labels are spaced    apart and a new token takes the midpoint of its neighbours; only when a gap runs out are    all labels respaced, keeping their order. Tokens with equal bytes share a label.    """    GAP = 1 << 32    def __init__(self, vocab: dict[int, bytes]):        self.tokens = sorted(set(vocab.values()))        self.labels = [(i + 1) * self.GAP for i in range(len(self.tokens))]        self.label = dict(zip(self.tokens, self.labels))        self.rank = {token_id: self.label[token] for token_id, token in vocab.items()}    def add(self, token_id: int, vocab: dict[int, bytes]) -> bool:        # Returns True when all labels were respaced, which invalidates every stored rank.        token = vocab[token_id]        relabeled = False        if token not in self.label:            i = bisect_left(self.tokens, token)            if not self._gap(i) > 1:                self.labels = [(j + 1) * self.GAP for j in range(len(self.tokens))]                self.label = dict(zip(self.tokens, self.labels))                self.rank = {other_id: self.label[vocab[other_id]] for other_id in self.rank}                relabeled = True            low = self.labels[i - 1] if i else 0            label = low + self._gap(i) // 2            self.tokens.insert(i, token)            self.labels.insert(i, label)            self.label[token] = label        self.rank[token_id] = self.label[token]        return relabeled    def _gap(self, i: int) -> int:        low = self.labels[i - 1] if i else 0        high = self.labels[i] if i < len(self.labels) else low + 2 * self.GAP        return high - lowclass PairHeapEntry:    __slots__ = ("freq", "key", "pair")    def __init__(self, freq, pair, token_rank):        self.freq = freq        self.key = (freq, token_rank[pair[0]], token_rank[pair[1]])        self.pair = pair    def __lt__(self, other):        # heapq is a min-heap, the inverted comparison pops the most frequent pair first        # and breaks ties on the lexicographically greater pair.        return self.key > other.keydef build_pair_heap(potential_merges: dict, token_rank: dict):    pair_heap = [PairHeapEntry(freq, pair, token_rank) for pair, freq in potential_merges.items()]    heapq.heapify(pair_heap)    return pair_heapdef relabel_pair_heap(pair_heap: list, token_rank: dict):    # Respacing keeps the order of the labels, so the heap invariant holds without re-heapifying.    for entry in pair_heap:        entry.key = (entry.freq, token_rank[entry.pair[0]], token_rank[entry.pair[1]])def update_pair_heap(pair_heap: list, changed_pairs: set, potential_merges: dict, token_rank: dict):    # Entries are invalidated lazily, so the heap is rebuilt once stale entries dominate it.    if len(pair_heap) + len(changed_pairs) > 2 * len(potential_merges) + 1024:        pair_heap[:] = build_pair_heap(potential_merges, token_rank)    else:        for pair in changed_pairs:            if pair in potential_merges:                heapq.heappush(pair_heap, PairHeapEntry(potential_merges[pair], pair, token_rank))    changed_pairs.clear()def get_best_pair(potential_merges: dict, pair_heap: list):    while pair_heap:        entry = heapq.heappop(pair_heap)        if potential_merges.get(entry.pair) == entry.freq:            return entry.pair    return Nonedef get_best_pairs(potential_merges: dict, pair_heap: list, k: int, max_candidates: int):    # The most frequent pairs that share no token, so they can all be merged in the same pass.    # Valid pairs passed over for a conflict go back on the heap for a later batch.    batch, skipped, used_tokens = [], [], set()    while pair_heap and len(batch) < k and len(batch) + len(skipped) < max_candidates:        entry = heapq.heappop(pair_heap)        if potential_merges.get(entry.pair) != entry.freq:            continue        if entry.pair[0] in used_tokens or entry.pair[1] in used_tokens:            skipped.append(entry)            continue        batch.append(entry.pair)        used_tokens.update(entry.pair)    for entry in skipped:        heapq.heappush(pair_heap, entry)    return batchdef merge_list_diff(reference_merges: list, merges: list) -> dict:    """    How far `merges` strays from `reference_merges`, e.g. a batched run from the exact one:    the length of their common prefix, the fraction of reference merges and tokens it also    learned, and the mean distance in rank of the merges both learned.    """    prefix = 0    for reference, merge in zip(reference_merges, merges):        if reference != merge:            break        prefix += 1    reference_ranks = {merge: rank for rank, merge in enumerate(reference_merges)}    rank_shifts = [abs(rank - reference_ranks[merge]) for rank, merge in enumerate(merges) if merge in reference_ranks]    reference_tokens = {left + right for left, right in reference_merges}    tokens = {left + right for left, right in merges}    return {        "common_prefix": prefix,        "shared_merges": len(rank_shifts) / len(reference_merges) if reference_merges else 1.0,        "shared_tokens": len(reference_tokens & tokens) / len(reference_tokens) if reference_tokens else 1.0,        "mean_rank_shift": sum(rank_shifts) / len(rank_shifts) if rank_shifts else 0.0,    }def word_merge(word, best_pair, new_token_id):    # Merges in place: the word only shrinks, so the write index never overtakes the read index.    left, right = best_pair    length = len(word)    read = write = 0    while read < length:        if read < length - 1 and word[read] == left and word[read + 1] == right:            word[write] = new_token_id            read += 2        else:            word[write] = word[read]            read += 1        write += 1    del word[write:]    return worddef decrement_counts(word_id, word, potential_merges, bigram_locations, count, changed_pairs):    for j in range(len(word) - 1):        bigram = (word[j], word[j + 1])        potential_merges[bigram] -= count        changed_pairs.add(bigram)        locations = bigram_locations.get(bigram)        if locations is not None:            locations.discard(word_id)            if not locations:                del bigram_locations[bigram]        if potential_merges[bigram] <= 0:            del potential_merges[bigram]def increment_counts(word_id, word, potential_merges, bigram_locations, count, changed_pairs):    for j in range(len(word) - 1):        bigram = (word[j], word[j + 1])        potential_merges[bigram] += count        changed_pairs.add(bigram)        bigram_locations[bigram].add(word_id)@contextmanagerdef gc_paused():    # Arrays and sets are tracked by the cyclic collector, which would otherwise sweep the growing    # tables over and over while millions of them are created. None of them can form a cycle.    enabled = gc.isenabled()    gc.disable()    try:        yield    finally:        if enabled:            gc.enable()def build_word_table(word_counts, special_tokens, byte_ids=None):    """    Lay the words out in CSR form: word i is tokens[offsets[i]:offsets[i + 1]] and occurs    word_freqs[i] times. Special tokens and single-byte words, which have no pairs and never    take part in a merge, are left out.    byte_ids maps each byte value to its token id when the vocabulary does not start with the 256 bytes.    """    special = set(special_tokens) | {token.encode("utf-8") for token in special_tokens}    data, byte_offsets, counts = pack_counts(word_counts)    lengths = np.diff(byte_offsets)    keep = lengths >= 2    for i, word in enumerate(word_counts):        if word in special:            keep[i] = False    tokens = data[np.repeat(keep, lengths)].astype(np.uint32)    if byte_ids is not None:        tokens = np.asarray(byte_ids, dtype=np.uint32)[tokens]    offsets = np.zeros(int(keep.sum()) + 1, dtype=np.int64)    np.cumsum(lengths[keep], out=offsets[1:])    return tokens, offsets, counts[keep]def split_words(tokens, offsets):    # The merge loop rewrites words in place, one compact array per word. np.uintc is the C    # unsigned int that array("I") stores, so the whole table is copied over in one go.    table = array("I")    table.frombytes(tokens.astype(np.uintc).tobytes())    bounds = offsets.tolist()    with gc_paused():        return [table[start:end] for start, end in zip(bounds[:-1], bounds[1:])]def prune_word_counts(word_counts, special_tokens, min_word_freq: int = 1, max_words: int | None = None):    """    Drop words seen fewer than min_word_freq times, then keep only the max_words most frequent    ones (ties broken on the word itself, so the result does not depend on counting order).    Returns the kept counts and the number and total frequency of the dropped words.    """    special = set(special_tokens) | {token.encode("utf-8") for token in special_tokens}    num_words = total_freq = 0    kept = {}    for word, count in word_counts.items():        if word in special:            continue        num_words += 1        total_freq += count        if count >= min_word_freq:            kept[word] = count    if max_words is not None and len(kept) > max_words:        kept = dict(heapq.nlargest(max_words, kept.items(), key=lambda item: (item[1], item[0])))    return kept, num_words - len(kept), total_freq - sum(kept.values())def count_pairs(tokens, offsets, word_freqs):    """    Count every adjacent pair of the CSR word table, weighted by word frequency, and list    the words it occurs in. Positions are sorted by pair, so each pair's total and distinct    words come out of a single pass over the sorted runs.    """    potential_merges = defaultdict(int)    bigram_locations = defaultdict(set)    if len(tokens) < 2:        return potential_merges, bigram_locations    # A position starts a pair unless it is the last token of its word.    word_ids = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))    starts = np.ones(len(tokens), dtype=bool)    starts[offsets[1:] - 1] = False    positions = np.flatnonzero(starts)    word_ids = word_ids[positions]    # Pairs are keyed in the narrowest integer that holds them: over the 256 byte tokens that is    # uint16, which numpy sorts with a radix sort. The sort is stable, so word ids stay ascending.    num_ids = int(tokens.max()) + 1    key_dtype = next(dtype for dtype in (np.uint16, np.uint32, np.uint64) if num_ids ** 2 <= np.iinfo(dtype).max + 1)    pairs = tokens[positions].astype(key_dtype) * key_dtype(num_ids) + tokens[positions + 1].astype(key_dtype)    order = np.argsort(pairs, kind="stable")    pairs = pairs[order]    word_ids = word_ids[order]    new_pair = np.concatenate(([True], pairs[1:] != pairs[:-1]))    pair_starts = np.flatnonzero(new_pair)    totals = np.add.reduceat(np.asarray(word_freqs, dtype=np.int64)[word_ids], pair_starts)    # A word holding the same pair twice is listed once.    distinct = new_pair | np.concatenate(([True], word_ids[1:] != word_ids[:-1]))    locations = np.split(word_ids[distinct], np.flatnonzero(new_pair[distinct])[1:])    unique_pairs = pairs[pair_starts].astype(np.uint64)    lefts = (unique_pairs // np.uint64(num_ids)).tolist()    rights = (unique_pairs % np.uint64(num_ids)).tolist()    with gc_paused():        for left, right, total, words in zip(lefts, rights, totals.tolist(), locations):            potential_merges[(left, right)] = total            bigram_locations[(left, right)] = set(words.tolist())    return potential_merges, bigram_locationsdef resolve_corpus_files(file_path: str | Path | list[str | Path]) -> list[Path]:    # A corpus is a single file, a directory of shards (searched recursively) or a list of either.    paths = file_path if isinstance(file_path, (list, tuple)) else [file_path]    files = []    for path in map(Path, paths):        if path.is_dir():            files.extend(sorted(p for p in path.rglob("*") if p.is_file() and not p.name.startswith(".")))        else:            files.append(path)    return filesdef plan_chunks(files: list[Path], special_tokens: list[str], chunk_size: int = DEFAULT_CHUNK_SIZE):    chunks = []    for file_path in files:        file_size = os.path.getsize(file_path)        if file_size == 0:            continue        num_chunks = file_size // chunk_size + 1        with open(file_path, 'rb') as f:            boundaries = find_chunk_boundaries(f,                                               desired_num_chunks=num_chunks,                                               split_special_token=[token.encode("utf-8") for token in special_tokens])        chunks.extend((file_path, start, end, special_tokens) for start, end in zip(boundaries[:-1], boundaries[1:]))    # Largest first, so the long tail of small shards keeps every worker busy until the end.    chunks.sort(key=lambda chunk: chunk[2] - chunk[1], reverse=True)    return chunksdef count_pre_tokens(file_path: str | Path | list[str | Path],                     special_tokens: list[str],                     chunk_size: int = DEFAULT_CHUNK_SIZE,                     num_workers: int | None = None,                     metrics: TrainingMetrics | None = None,                     shard_index: int = 0,                     num_shards: int = 1,                     ):    metrics = metrics or TrainingMetrics()    word_counts = Counter()    with metrics.phase("chunking"):        chunks = plan_chunks(resolve_corpus_files(file_path), special_tokens, chunk_size)        # The plan is deterministic, so every shard agrees on it. Dealing out the largest-first        # order round-robin gives each shard a similar amount of text.        chunks = chunks[shard_index::num_shards]    if not chunks:        return word_counts    num_workers = min(num_workers or mp.cpu_count(), len(chunks))    # Reduction overlaps with the workers, so its parent-side time is reported on its own.    reduction_seconds = 0.0    with metrics.phase("pre_tokenization", chunks=len(chunks), workers=num_workers):        # Counts are reduced as chunks complete, so at most a few packed chunk results are alive at once.        with mp.Pool(processes=num_workers) as pool:            for packed in pool.imap_unordered(process_chunk_args, chunks):                start = time.perf_counter()                merge_packed_counts(word_counts, *packed)                del packed                reduction_seconds += time.perf_counter() - start    metrics.emit("phase", phase="reduction", seconds=reduction_seconds, distinct_pre_tokens=len(word_counts))    return word_countsdef load_or_count_pre_tokens(file_path: str | Path | list[str | Path],                             special_tokens: list[str],                             cache_dir: str | Path | None = None,                             chunk_size: int = DEFAULT_CHUNK_SIZE,                             num_workers: int | None = None,                             metrics: TrainingMetrics | None = None,                             ):    metrics = metrics or TrainingMetrics()    if cache_dir is None:        return count_pre_tokens(file_path, special_tokens, chunk_size, num_workers, metrics)    cache_path = counts_cache_path(cache_dir, resolve_corpus_files(file_path), special_tokens, PAT)    if cache_path.exists():        with metrics.phase("cache_load", path=str(cache_path)):            return load_counts(cache_path)    word_counts = count_pre_tokens(file_path, special_tokens, chunk_size, num_workers, metrics)    with metrics.phase("cache_save"):        save_counts(cache_path, word_counts, counts_metadata(special_tokens))    return word_countsdef counts_metadata(special_tokens: list[str]) -> dict:    return {"special_tokens": special_tokens, "pattern": PAT}def check_counts_metadata(metadata: dict, special_tokens: list[str]):    # Counts from another pre-tokenization hold pre-tokens the trained tokenizer would never see.    expected = counts_metadata(special_tokens)    found = {key: metadata.get(key) for key in expected}    if found != expected:        raise ValueError(f"Pre-token counts were made with {found}, training uses {expected}")def count_shard(file_path: str | Path | list[str | Path],                output_path: str | Path,                special_tokens: list[str],                shard_index: int = 0,                num_shards: int = 1,                chunk_size: int = DEFAULT_CHUNK_SIZE,                num_workers: int | None = None,                metrics: TrainingMetrics | None = None,                ):    """    The map step of multi-machine pre-tokenization: count shard `shard_index` of `num_shards`    of the corpus and write a count file for merge_count_files. Every machine must see the same    corpus and use the same chunk_size, so they all split it into the same chunks.    """    if not 0 <= shard_index < num_shards:        raise ValueError(f"shard_index must be in [0, {num_shards}), got {shard_index}")    metrics = metrics or TrainingMetrics()    word_counts = count_pre_tokens(file_path, special_tokens, chunk_size, num_workers, metrics,                                   shard_index, num_shards)    # merge_count_files checks these, so shards of different corpora or splits are never summed.    metadata = {**counts_metadata(special_tokens), "chunk_size": chunk_size,                "corpus": [corpus_fingerprint(path, include_mtime=False) for path in resolve_corpus_files(file_path)],                "shard_index": shard_index, "num_shards": num_shards}    with metrics.phase("counts_save"):        save_counts(output_path, word_counts, metadata)    return word_countsdef text_batches(texts, batch_size: int):    batch, batch_bytes = [], 0    for text in texts:        batch.append(text)        batch_bytes += len(text)        if batch_bytes >= batch_size:            yield batch            batch, batch_bytes = [], 0    if batch:        yield batchdef bounded_imap(pool, func, args_iterable, max_pending: int):    # Like Pool.imap, but Pool.imap drains its whole input up front; here at most max_pending tasks are queued.    pending = deque()    for args in args_iterable:        pending.append(pool.apply_async(func, args))        while len(pending) >= max_pending or (pending and pending[0].ready()):            yield pending.popleft().get()    while pending:        yield pending.popleft().get()def count_pre_tokens_from_iterator(texts,                                   special_tokens: list[str],                                   batch_size: int = DEFAULT_CHUNK_SIZE,                                   num_workers: int | None = None,                                   metrics: TrainingMetrics | None = None,                                   ):    """    Count the pre-tokens of an iterable of documents, str or UTF-8 bytes, as it is consumed.    Documents are grouped into batches of about batch_size bytes that workers pre-tokenize.    At most two batches per worker are in flight, so memory stays bounded however long the stream.    """    metrics = metrics or TrainingMetrics()    word_counts = Counter()    num_workers = num_workers or mp.cpu_count()    max_pending = 2 * num_workers    reduction_seconds = 0.0    num_batches = 0    with metrics.phase("pre_tokenization", workers=num_workers):        with mp.Pool(processes=num_workers) as pool:            batches = ((batch, special_tokens) for batch in text_batches(texts, batch_size))            for packed in bounded_imap(pool, process_text_batch, batches, max_pending):                num_batches += 1                start = time.perf_counter()                merge_packed_counts(word_counts, *packed)                del packed                reduction_seconds += time.perf_counter() - start    metrics.emit("phase", phase="reduction", seconds=reduction_seconds, batches=num_batches,                 distinct_pre_tokens=len(word_counts))    return word_countsdef emit_snapshots(pending_sizes: list, vocab: dict, merges: list, on_snapshot, final: bool = False):    # Merges are prefix-consistent, so the state after reaching a size is exactly what training to it returns.    while pending_sizes and (final or pending_sizes[0] <= len(vocab)):        size = pending_sizes.pop(0)        if on_snapshot is not None:            on_snapshot(size, dict(vocab), [(vocab[p1], vocab[p2]) for p1, p2 in merges])def train_bpe(file_path: str | Path | list[str | Path],              vocab_size: int | list[int],              special_tokens: list[str],              cache_dir: str | Path | None = None,              on_snapshot=None,              checkpoint_path: str | Path | None = None,              checkpoint_every: int = 1000,              base_vocab: dict[int, bytes] | None = None,              base_merges: list[tuple[bytes, bytes]] | None = None,              chunk_size: int = DEFAULT_CHUNK_SIZE,              num_workers: int | None = None,              metrics: TrainingMetrics | None = None,              min_word_freq: int = 1,              max_words: int | None = None,              merge_batch_size: int = 1,              compare_exact: bool = False,              merge_workers: int = 1,              ):    if not isinstance(special_tokens, list):        special_tokens = []    # Passed on without keeping a reference, so the counts can be freed once the word table is built.    return train_bpe_from_counts(        load_or_count_pre_tokens(file_path, special_tokens, cache_dir, chunk_size, num_workers, metrics),        vocab_size, special_tokens, on_snapshot, checkpoint_path, checkpoint_every,        base_vocab, base_merges, metrics, min_word_freq, max_words, merge_batch_size, compare_exact, merge_workers)def train_bpe_from_iterator(texts,                            vocab_size: int | list[int],                            special_tokens: list[str],                            batch_size: int = DEFAULT_CHUNK_SIZE,                            num_workers: int | None = None,                            metrics: TrainingMetrics | None = None,                            **kwargs,                            ):    """    Train on an iterable of documents, str or UTF-8 bytes, without writing it to disk first.    Special tokens inside a document split it as they do a file. The remaining keyword    arguments are those of train_bpe_from_counts.    """    if not isinstance(special_tokens, list):        special_tokens = []    return train_bpe_from_counts(        count_pre_tokens_from_iterator(texts, special_tokens, batch_size, num_workers, metrics),        vocab_size, special_tokens, metrics=metrics, **kwargs)def train_bpe_from_counts(word_counts: Counter,                          vocab_size: int | list[int],                          special_tokens: list[str],                          on_snapshot=None,                          checkpoint_path: str | Path | None = None,                          checkpoint_every: int = 1000,                          base_vocab: dict[int, bytes] | None = None,                          base_merges: list[tuple[bytes, bytes]] | None = None,                          metrics: TrainingMetrics | None = None,                          min_word_freq: int = 1,                          max_words: int | None = None,                          merge_batch_size: int = 1,                          compare_exact: bool = False,                          merge_workers: int = 1,                          ):    """    Train up to the largest of `vocab_size`, which may be a list of sizes. When given,    on_snapshot(size, vocab, merges) is called as soon as the merge loop reaches each size.    With base_vocab and base_merges the run warm-starts from an existing tokenizer: its    merges are replayed over word_counts and training continues from there, keeping    every existing token id.    Words rarer than min_word_freq, and all but the max_words most frequent words, are left    out of training. This bounds memory and per-merge work on long-tailed corpora at the cost    of ignoring their pairs; the discarded frequency mass is reported to `metrics`.    With merge_batch_size > 1, each step of the merge loop applies up to that many of the most    frequent pairs that share no token, in a single pass over the words they occur in. The    merge order is then only approximately the exact one; compare_exact also trains the exact    merges from the same counts and reports the difference (see merge_list_diff).    merge_workers > 1 shards the word table across that many processes for the merge loop    (see ShardedWordTable). The merges are the same as with a single process.    Phase timings and merge-loop progress are reported to `metrics` when given.    """    metrics = metrics or TrainingMetrics()    if min_word_freq > 1 or max_words is not None:        with metrics.phase("pruning"):            word_counts, dropped_words, dropped_freq = prune_word_counts(word_counts, special_tokens,                                                                         min_word_freq, max_words)        total_freq = sum(word_counts.values()) + dropped_freq        dropped_fraction = dropped_freq / total_freq if total_freq else 0.0        metrics.emit("pruning", kept_words=len(word_counts), dropped_words=dropped_words,                     dropped_frequency=dropped_freq, dropped_fraction=dropped_fraction)    exact_merges = None    if compare_exact and merge_batch_size > 1:        with metrics.phase("exact_training"):            exact_state = init_training_state(word_counts, special_tokens, base_vocab, base_merges)            _, exact_merges = run_merges(exact_state, max(vocab_size) if isinstance(vocab_size, (list, tuple))                                         else vocab_size)            del exact_state    state = init_training_state(word_counts, special_tokens, base_vocab, base_merges, metrics)    del word_counts    vocab, merges = run_merges(state, vocab_size, on_snapshot, checkpoint_path, checkpoint_every, metrics,                               merge_batch_size, merge_workers)    if exact_merges is not None:        diff = merge_list_diff(exact_merges, merges)        metrics.emit("merge_diff", merge_batch_size=merge_batch_size, **diff)    return vocab, mergesdef resume_train_bpe(checkpoint_path: str | Path,                     vocab_size: int | list[int],                     on_snapshot=None,                     checkpoint_every: int = 1000,                     metrics: TrainingMetrics | None = None,                     merge_batch_size: int = 1,                     merge_workers: int = 1,                     ):    """    Continue a run from the checkpoint written by train_bpe, without pre-tokenizing the    corpus or recounting pairs. Snapshot sizes the checkpointed run already passed are skipped.    """    metrics = metrics or TrainingMetrics()    with metrics.phase("checkpoint_load"):        state = load_checkpoint(checkpoint_path)    metrics.emit("resume", merges=len(state["merges"]))    return run_merges(state, vocab_size, on_snapshot, checkpoint_path, checkpoint_every, metrics,                      merge_batch_size, merge_workers, resumed=True)def init_training_state(word_counts: Counter,                        special_tokens: list[str],                        base_vocab: dict[int, bytes] | None = None,                        base_merges: list[tuple[bytes, bytes]] | None = None,                        metrics: TrainingMetrics | None = None,                        ):    metrics = metrics or TrainingMetrics()    if base_vocab is None:        vocab = {i: bytes([i]) for i in range(256)}    else:        vocab = dict(base_vocab)    token_ids = {token: token_id for token_id, token in vocab.items()}    next_token_id = max(vocab) + 1    for token in special_tokens:        encoded = token.encode("utf-8")        if encoded not in token_ids:            vocab[next_token_id] = encoded            token_ids[encoded] = next_token_id            next_token_id += 1    try:        byte_ids = [token_ids[bytes([b])] for b in range(256)]    except KeyError as e:        raise ValueError(f"Base vocabulary is missing the single byte token {e}") from None    with metrics.phase("word_table"):        tokens, offsets, word_freqs = build_word_table(word_counts, special_tokens,                                                       None if byte_ids == list(range(256)) else byte_ids)    with metrics.phase("pair_counting", words=len(word_freqs)):        potential_merges, bigram_locations = count_pairs(tokens, offsets, word_freqs)    words = split_words(tokens, offsets)    word_freqs = word_freqs.tolist()    del tokens, offsets    state = {        "special_tokens": special_tokens,        "vocab": vocab,        "token_ranks": TokenRanks(vocab),        "next_token_id": next_token_id,        "merges": [],        "words": words,        "word_freqs": word_freqs,        "potential_merges": potential_merges,        "bigram_locations": bigram_locations,    }    # Replaying the base merges in order leaves the words exactly as the base tokenizer would split them.    changed_pairs = set()    with metrics.phase("replay", merges=len(base_merges or [])):        for left, right in base_merges or []:            try:                pair = (token_ids[left], token_ids[right])                new_token_id = token_ids[left + right]            except KeyError:                raise ValueError(f"Base merge {(left, right)} is not covered by the base vocabulary") from None            state["merges"].append(pair)            apply_merge(state, pair, new_token_id, changed_pairs)    return statedef save_checkpoint(checkpoint_path: str | Path, state: dict):    checkpoint_path = Path(checkpoint_path)    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)    # Written next to the target and renamed, so a run killed mid-write keeps its previous checkpoint.    tmp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")    with open(tmp_path, "wb") as f:        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)    os.replace(tmp_path, checkpoint_path)def load_checkpoint(checkpoint_path: str | Path):    with open(checkpoint_path, "rb") as f:        state = pickle.load(f)    # Checkpoints from before integer ranks broke ties on latin-1 strings, which order like the bytes.    if "token_str" in state:        del state["token_str"]        state["token_ranks"] = TokenRanks(state["vocab"])    return statedef apply_merge(state: dict, pair: tuple[int, int], new_token_id: int, changed_pairs: set):    words = state["words"]    word_freqs = state["word_freqs"]    potential_merges = state["potential_merges"]    bigram_locations = state["bigram_locations"]    # The pair never reappears once merged, so its posting list can be taken out whole.    words_affected = bigram_locations.pop(pair, ())    for word_id in words_affected:        word = words[word_id]        count = word_freqs[word_id]        # Decrement stats for all bigrams in the OLD word.        decrement_counts(word_id, word, potential_merges, bigram_locations, count, changed_pairs)        # Merging        word_merge(word, pair, new_token_id)        # Increment stats for all bigrams in the NEW word.        increment_counts(word_id, word, potential_merges, bigram_locations, count, changed_pairs)    return len(words_affected)def apply_merges(state: dict, batch: list[tuple[tuple[int, int], int]], changed_pairs: set):    # Pairs in a batch share no token, so merging them one after the other within a word    # gives the same result in any order and each word is recounted once.    if len(batch) == 1:        return apply_merge(state, *batch[0], changed_pairs)    words = state["words"]    word_freqs = state["word_freqs"]    potential_merges = state["potential_merges"]    bigram_locations = state["bigram_locations"]    # Each word only runs the merges of the pairs it contains.    words_affected = defaultdict(list)    for pair, new_token_id in batch:        for word_id in bigram_locations.pop(pair, ()):            words_affected[word_id].append((pair, new_token_id))    for word_id, word_merges in words_affected.items():        word = words[word_id]        count = word_freqs[word_id]        decrement_counts(word_id, word, potential_merges, bigram_locations, count, changed_pairs)        for pair, new_token_id in word_merges:            word_merge(word, pair, new_token_id)        increment_counts(word_id, word, potential_merges, bigram_locations, count, changed_pairs)    return len(words_affected)def pack_words(words):    offsets = np.zeros(len(words) + 1, dtype=np.int64)    np.cumsum([len(word) for word in words], out=offsets[1:])    tokens = np.frombuffer(b"".join(word.tobytes() for word in words), dtype=np.uintc)    return tokens, offsetsdef shard_merge_deltas(words, word_freqs, bigram_locations, batch):    # The shard's half of apply_merges: pair counts live in the parent, so only their changes are returned.    deltas = defaultdict(int)    words_affected = defaultdict(list)    for pair, new_token_id in batch:        for word_id in bigram_locations.pop(pair, ()):            words_affected[word_id].append((pair, new_token_id))    for word_id, word_merges in words_affected.items():        word = words[word_id]        count = word_freqs[word_id]        for j in range(len(word) - 1):            bigram = (word[j], word[j + 1])            deltas[bigram] -= count            locations = bigram_locations.get(bigram)            if locations is not None:                locations.discard(word_id)                if not locations:                    del bigram_locations[bigram]        for pair, new_token_id in word_merges:            word_merge(word, pair, new_token_id)        for j in range(len(word) - 1):            bigram = (word[j], word[j + 1])            deltas[bigram] += count            bigram_locations[bigram].add(word_id)    return dict(deltas), len(words_affected)def merge_shard_worker(conn, tokens, offsets, word_freqs):    words = split_words(tokens, offsets)    _, bigram_locations = count_pairs(tokens, offsets, word_freqs)    word_freqs = word_freqs.tolist()    del tokens, offsets    while True:        command, batch = conn.recv()        if command == "merge":            conn.send(shard_merge_deltas(words, word_freqs, bigram_locations, batch))        elif command == "gather":            conn.send(pack_words(words))        else:            break    conn.close()class ShardedWordTable:    """    The word table split by word id across worker processes. Every merge is sent to all    shards, each rewrites its own words and returns the pair-count deltas, and their sum is    exactly the update apply_merges makes. Pays off once single merges touch so many words    that the serial update outweighs a round trip to every worker.    """    def __init__(self, words: list, word_freqs: list, num_shards: int):        tokens, offsets = pack_words(words)        word_freqs = np.asarray(word_freqs, dtype=np.int64)        # Shards hold about the same number of tokens rather than of words.        bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], num_shards + 1)).tolist()        bounds[0], bounds[-1] = 0, len(words)        self.connections = []        self.processes = []        for start, end in zip(bounds[:-1], bounds[1:]):            parent_conn, child_conn = mp.Pipe()            process = mp.Process(target=merge_shard_worker,                                 args=(child_conn, tokens[offsets[start]:offsets[end]],                                       offsets[start:end + 1] - offsets[start], word_freqs[start:end]),                                 daemon=True)            process.start()            child_conn.close()            self.connections.append(parent_conn)            self.processes.append(process)    def apply(self, batch: list[tuple[tuple[int, int], int]], potential_merges: dict, changed_pairs: set):        for conn in self.connections:            conn.send(("merge", batch))        affected_words = 0        for conn in self.connections:            deltas, shard_affected_words = conn.recv()            affected_words += shard_affected_words            for pair, delta in deltas.items():                potential_merges[pair] += delta            changed_pairs.update(deltas)        for pair in changed_pairs:            if potential_merges.get(pair, 0) <= 0:                potential_merges.pop(pair, None)        return affected_words    def gather(self, state: dict):        # Puts the current words and their postings back into state, e.g. to checkpoint it.        for conn in self.connections:            conn.send(("gather", None))        shards = [conn.recv() for conn in self.connections]        tokens = np.concatenate([shard_tokens for shard_tokens, _ in shards])        offsets = [np.zeros(1, dtype=np.int64)]        for _, shard_offsets in shards:            offsets.append(shard_offsets[1:] + offsets[-1][-1])        offsets = np.concatenate(offsets)        state["words"] = split_words(tokens, offsets)        _, state["bigram_locations"] = count_pairs(tokens, offsets, state["word_freqs"])    def close(self):        for conn in self.connections:            conn.send(("stop", None))            conn.close()        for process in self.processes:            process.join()    def __enter__(self):        return self    def __exit__(self, *exc):        self.close()def run_merges(state: dict,               vocab_size: int | list[int],               on_snapshot=None,               checkpoint_path: str | Path | None = None,               checkpoint_every: int = 1000,               metrics: TrainingMetrics | None = None,               merge_batch_size: int = 1,               merge_workers: int = 1,               resumed: bool = False,               ):    metrics = metrics or TrainingMetrics()    vocab = state["vocab"]    token_ranks = state["token_ranks"]    merges = state["merges"]    potential_merges = state["potential_merges"]    sizes = sorted(set(vocab_size)) if isinstance(vocab_size, (list, tuple)) else [vocab_size]    target_size = sizes[-1]    # A resumed run already emitted every size its checkpoint had passed. A fresh run, warm-started    # or not, emits the sizes its starting vocabulary already reaches right away.    pending_sizes = [size for size in sizes if not resumed or size > len(vocab)]    with metrics.phase("pair_heap", pairs=len(potential_merges)):        pair_heap = build_pair_heap(potential_merges, token_ranks.rank)    changed_pairs = set()    emit_snapshots(pending_sizes, vocab, merges, on_snapshot)    table = None    if merge_workers > 1:        with metrics.phase("sharding", shards=merge_workers):            table = ShardedWordTable(state["words"], state["word_freqs"], merge_workers)        # The shards own the words from here on, they come back into state only to be checkpointed.        state["words"] = state["bigram_locations"] = None    def checkpoint():        if table is not None:            table.gather(state)        save_checkpoint(checkpoint_path, state)        if table is not None:            state["words"] = state["bigram_locations"] = None    # --- The Merging Loop ---    progress = MergeProgress(metrics)    merging_start = time.perf_counter()    merges_before = len(merges)    try:        while len(vocab) < target_size:            if not potential_merges:                metrics.emit("early_stop", vocab_size=len(vocab), merges=len(merges))                break            if merge_batch_size == 1:                pairs = [get_best_pair(potential_merges, pair_heap)]            else:                # A batch never steps over a snapshot size, so every snapshot has exactly its size.                room = (pending_sizes[0] if pending_sizes else target_size) - len(vocab)                pairs = get_best_pairs(potential_merges, pair_heap, min(merge_batch_size, room), 4 * merge_batch_size)            batch = []            merges_before_batch = len(merges)            for pair in pairs:                new_token_id = state["next_token_id"]                state["next_token_id"] += 1                merges.append(pair)                vocab[new_token_id] = vocab[pair[0]] + vocab[pair[1]]                if token_ranks.add(new_token_id, vocab):                    relabel_pair_heap(pair_heap, token_ranks.rank)                batch.append((pair, new_token_id))            if table is None:                affected_words = apply_merges(state, batch, changed_pairs)            else:                affected_words = table.apply(batch, potential_merges, changed_pairs)            update_pair_heap(pair_heap, changed_pairs, potential_merges, token_ranks.rank)            emit_snapshots(pending_sizes, vocab, merges, on_snapshot)            progress.update(len(merges), affected_words, len(potential_merges), len(batch))            if checkpoint_path is not None and len(merges) // checkpoint_every > merges_before_batch // checkpoint_every:                checkpoint()        progress.flush(len(merges), len(potential_merges))        metrics.emit("phase", phase="merging", seconds=time.perf_counter() - merging_start,                     merges=len(merges) - merges_before)        emit_snapshots(pending_sizes, vocab, merges, on_snapshot, final=True)        if checkpoint_path is not None:            checkpoint()    finally:        if table is not None:            table.close()    readable_merges = [(vocab[p1], vocab[p2]) for p1, p2 in merges]    return vocab, readable_merges
\ No newline at end of file
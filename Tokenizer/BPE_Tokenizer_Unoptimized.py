@@ -15,7 +15,7 @@ def pre_tokenization(training_data, special_tokens):
     PAT = r"""'(?:[sdmt]|ll|ve|re)| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
     # splitting on special tokens
     escaped_list = [re.escape(special_token) for special_token in special_tokens]
-    split_PAT = f"({"|".join(escaped_list)})"
+    split_PAT = "({})".format("|".join(escaped_list))
     split_corpus = re.split(split_PAT, training_data)
     # Pre-tokenization
     pretokenized_train_data = []
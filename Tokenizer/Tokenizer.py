@@ -1,8 +1,35 @@
+import heapq
 import json
+import multiprocessing as mp
 from collections import OrderedDict
+from itertools import chain
 from typing import Iterable, Iterator
 from Tokenizer.BPE_Tokenizer_Optimized import pre_tokenization
 from pathlib import Path
+import numpy as np
+
+# Set in each encode_batch worker by the pool initializer, so the tokenizer is sent over once.
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_texts(texts):
+    return [_worker_tokenizer.encode(text) for text in texts]
+
+
+def _pack_ids(encoded: list[list[int]], dtype) -> tuple[np.ndarray, np.ndarray]:
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    ids = np.fromiter(chain.from_iterable(encoded), dtype=dtype, count=int(lengths.sum()))
+    return ids, lengths
+
+
+def _encode_texts_packed(texts):
+    # Flat arrays pickle as raw buffers, far cheaper to send back than lists of ints.
+    return _pack_ids(_encode_texts(texts), _worker_tokenizer.token_dtype)
 
 class Tokenizer:
     def __init__(self, vocab:dict[int, bytes],
@@ -11,7 +38,6 @@ class Tokenizer:
                  cache_size = 50000):
 
         self.vocab = vocab
-        self.merge_priority = {pair: rank for rank, pair in enumerate(merges)}
         self.merges = merges
         self.BPE_cache = OrderedDict()
         self.max_cache_size = cache_size
@@ -20,6 +46,24 @@ class Tokenizer:
         else:
             self.special_tokens = special_tokens
         self.reverse_vocab = {value: key for key, value in vocab.items()}
+        self.byte_ids = [self.reverse_vocab.get(bytes([b])) for b in range(256)]
+        self.merge_table = self._compile_merges(merges)
+        # The narrowest unsigned type that holds every id, for array outputs.
+        self.token_dtype = np.dtype(np.uint16 if max(vocab, default=0) < 2 ** 16 else np.uint32)
+        self._pool = None
+        self._pool_workers = 0
+
+    def _compile_merges(self, merges: list[tuple[bytes, bytes]]) -> dict[tuple[int, int], tuple[int, int]]:
+        # (left_id, right_id) -> (rank, merged_id), so encoding never touches bytes after the first lookup.
+        # A merge whose tokens are not all in the vocabulary can never apply to an id sequence and is left out.
+        merge_table = {}
+        for rank, (left, right) in enumerate(merges):
+            left_id = self.reverse_vocab.get(left)
+            right_id = self.reverse_vocab.get(right)
+            merged_id = self.reverse_vocab.get(left + right)
+            if left_id is not None and right_id is not None and merged_id is not None:
+                merge_table[(left_id, right_id)] = (rank, merged_id)
+        return merge_table
 
     @classmethod
     def from_files(cls, vocab_filepath:str | Path,
@@ -72,24 +116,7 @@ class Tokenizer:
                 except KeyError:
                     raise Exception("Special Token Not in Vocabulary")
             else:
-                encoded_token = pre_token.encode("utf-8")
-                tokens = [bytes([b]) for b in encoded_token]
-
-                while True:
-                    pairs = [(tokens[i], tokens[i + 1]) for i in range(len(tokens) - 1)]
-                    merge_ranks = [self.merge_priority.get(p, float('inf')) for p in pairs]
-
-                    if all(rank == float('inf') for rank in merge_ranks):
-                        break
-
-                    i = min(range(len(merge_ranks)), key=merge_ranks.__getitem__)
-                    tokens[i:i + 2] = [tokens[i] + tokens[i + 1]]
-
-                for tok in tokens:
-                    try:
-                        pre_token_list.append(self.reverse_vocab[tok])
-                    except KeyError:
-                        raise Exception(f"Token {tok} not in vocabulary")
+                pre_token_list = self._merge(pre_token.encode("utf-8"))
 
             self.BPE_cache[pre_token] = pre_token_list
             self.BPE_cache.move_to_end(pre_token)
@@ -100,12 +127,132 @@ class Tokenizer:
 
         return token_ids_list
 
+    def _merge(self, encoded_token: bytes) -> list[int]:
+        # Tokens form a linked list over their starting positions and candidate pairs wait in a
+        # heap ordered by (rank, position), so every merge only touches its two neighbours.
+        # Popping the lowest rank, leftmost first, merges in the same order as rescanning all pairs.
+        byte_ids = self.byte_ids
+        tokens = [byte_ids[b] for b in encoded_token]
+        if None in tokens:
+            raise Exception(f"Token {bytes([encoded_token[tokens.index(None)]])} not in vocabulary")
+        length = len(tokens)
+        next_index = list(range(1, length + 1))
+        prev_index = list(range(-1, length - 1))
+        merge_table = self.merge_table
+
+        heap = []
+        for i in range(length - 1):
+            merge = merge_table.get((tokens[i], tokens[i + 1]))
+            if merge is not None:
+                heap.append((merge[0], i, merge[1], tokens[i], tokens[i + 1]))
+        heapq.heapify(heap)
+
+        while heap:
+            _, i, merged_id, left, right = heapq.heappop(heap)
+            j = next_index[i]
+            # Entries are never removed, one is stale once either of its tokens has grown by a merge.
+            if j >= length or tokens[i] != left or tokens[j] != right:
+                continue
+
+            tokens[i] = merged_id
+            tokens[j] = None
+            next_index[i] = next_index[j]
+            if next_index[i] < length:
+                prev_index[next_index[i]] = i
+
+            for a, b in ((prev_index[i], i), (i, next_index[i])):
+                if a >= 0 and b < length:
+                    merge = merge_table.get((tokens[a], tokens[b]))
+                    if merge is not None:
+                        heapq.heappush(heap, (merge[0], a, merge[1], tokens[a], tokens[b]))
+
+        return [token for token in tokens if token is not None]
+
+    def encode_batch(self, texts: list[str], num_workers: int | None = None, flat: bool = False):
+        """
+        Encode many texts across a pool of worker processes, which is started on first use and
+        kept for later calls. Returns one list of ids per text, or with flat=True a single id
+        array and the offsets of each text in it: text i is ids[offsets[i]:offsets[i + 1]].
+        """
+        num_workers = num_workers or mp.cpu_count()
+        if num_workers == 1 or len(texts) <= 1:
+            encoded = [self.encode(text) for text in texts]
+            results = [_pack_ids(encoded, self.token_dtype)] if flat else [encoded]
+        else:
+            if self._pool is None or self._pool_workers != num_workers:
+                self.close()
+                self._pool = mp.Pool(num_workers, initializer=_init_worker, initargs=(self,))
+                self._pool_workers = num_workers
+            # A few batches per worker balance uneven texts without paying IPC for every single one.
+            batch_size = max(1, len(texts) // (4 * num_workers))
+            batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+            results = list(self._pool.imap(_encode_texts_packed if flat else _encode_texts, batches))
+
+        if not flat:
+            return [ids for batch in results for ids in batch]
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        if texts:
+            np.cumsum(np.concatenate([lengths for _, lengths in results]), out=offsets[1:])
+        ids = np.concatenate([batch_ids for batch_ids, _ in results])
+        return ids, offsets
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._pool_workers = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        # Workers get the vocabulary and merges, not the pool or this process's cache.
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pool_workers"] = 0
+        state["BPE_cache"] = OrderedDict()
+        return state
+
     def encode_iterable(self, iterable: Iterable[str]) -> Iterator[int]:
         for chunk in iterable:
             chunk_ids = self.encode(chunk)
             for idd in chunk_ids:
                 yield idd
 
+    def encode_to_array(self, text: str, out: np.ndarray | None = None) -> np.ndarray:
+        return self.encode_iterable_to_array([text], out)
+
+    def encode_iterable_to_array(self, iterable: Iterable[str], out: np.ndarray | None = None) -> np.ndarray:
+        """
+        Encode every chunk of the iterable into one array of token_dtype ids. With out, ids are
+        written into that preallocated array and the filled part of it is returned, otherwise
+        into an array that doubles as it fills. Each chunk is converted in bulk, not id by id.
+        """
+        growable = out is None
+        if growable:
+            out = np.empty(1024, dtype=self.token_dtype)
+        position = 0
+        for chunk in iterable:
+            ids = self.encode(chunk)
+            end = position + len(ids)
+            if end > len(out):
+                if not growable:
+                    raise ValueError(f"Output array of length {len(out)} is too small for the encoded ids")
+                grown = np.empty(max(2 * len(out), end), dtype=self.token_dtype)
+                grown[:position] = out[:position]
+                out = grown
+            out[position:end] = ids
+            position = end
+        if growable:
+            # Gives the unused capacity back instead of keeping it alive behind a view.
+            out.resize(position, refcheck=False)
+            return out
+        return out[:position]
+
 
     def decode(self, ids: list[int]) -> str:
         byte_sequence = b""
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+COUNTS_FORMAT_VERSION = 1
+FINGERPRINT_SAMPLES = 8
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+# Metadata that differs between the shards of one corpus, everything else must agree.
+SHARD_FIELDS = ("shard_index", "num_shards")
+
+
+def pack_counts(word_counts: dict) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pack pre-token counts into one concatenated byte buffer, the offsets of every
+    pre-token inside it and their counts. Pre-token i is data[offsets[i]:offsets[i + 1]].
+    str keys are stored as their UTF-8 bytes, and unpacked counts are keyed by bytes.
+    """
+    encoded = [word if isinstance(word, bytes) else word.encode("utf-8", errors="surrogateescape")
+               for word in word_counts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(word) for word in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    counts = np.fromiter(word_counts.values(), dtype=np.int64, count=len(word_counts))
+    return data, offsets, counts
+
+
+def merge_packed_counts(word_counts: Counter, data: np.ndarray, offsets: np.ndarray, counts: np.ndarray) -> Counter:
+    # Folds packed counts straight into word_counts, without an intermediate dict per chunk.
+    buffer = data.tobytes()
+    bounds = offsets.tolist()
+    get = word_counts.get
+    for i, count in enumerate(counts.tolist()):
+        word = buffer[bounds[i]:bounds[i + 1]]
+        word_counts[word] = get(word, 0) + count
+    return word_counts
+
+
+def unpack_counts(data: np.ndarray, offsets: np.ndarray, counts: np.ndarray) -> Counter:
+    return merge_packed_counts(Counter(), data, offsets, counts)
+
+
+def save_counts(path: str | Path, word_counts: dict, metadata: dict | None = None):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data, offsets, counts = pack_counts(word_counts)
+    # Written next to the target and renamed, so a killed run never leaves a truncated file behind.
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, data=data, offsets=offsets, counts=counts,
+                 version=np.array(COUNTS_FORMAT_VERSION), metadata=np.array(json.dumps(metadata or {})))
+    os.replace(tmp_path, path)
+
+
+def _read_metadata(path: str | Path, arrays) -> dict:
+    if int(arrays["version"]) != COUNTS_FORMAT_VERSION:
+        raise ValueError(f"Unsupported pre-token count file version in {path}")
+    return json.loads(str(arrays["metadata"])) if "metadata" in arrays.files else {}
+
+
+def load_counts(path: str | Path) -> Counter:
+    with np.load(path) as arrays:
+        _read_metadata(path, arrays)
+        return unpack_counts(arrays["data"], arrays["offsets"], arrays["counts"])
+
+
+def load_counts_metadata(path: str | Path) -> dict:
+    with np.load(path) as arrays:
+        return _read_metadata(path, arrays)
+
+
+def _check_count_files(paths: list[str | Path], metadatas: list[dict]) -> dict:
+    settings = None
+    for path, metadata in zip(paths, metadatas):
+        file_settings = {key: value for key, value in metadata.items() if key not in SHARD_FIELDS}
+        if settings is None:
+            settings = file_settings
+        elif file_settings != settings:
+            raise ValueError(f"{path} was counted with different settings: {file_settings} != {settings}")
+
+    shard_indices = [metadata.get("shard_index") for metadata in metadatas]
+    if any(index is not None for index in shard_indices):
+        num_shards = {metadata.get("num_shards") for metadata in metadatas}
+        if None in shard_indices or len(num_shards) != 1:
+            raise ValueError("Shard count files can only be merged with the other shards of the same split")
+        num_shards = num_shards.pop()
+        # A duplicated or missing shard would be summed into plausible but wrong counts.
+        if sorted(shard_indices) != list(range(num_shards)):
+            raise ValueError(f"Expected each of the {num_shards} shards exactly once, "
+                             f"got shards {sorted(shard_indices)}")
+    return settings or {}
+
+
+def merge_count_files(paths: list[str | Path], output_path: str | Path | None = None) -> Counter:
+    """
+    Sum the counts of several count files, e.g. one per shard of a corpus counted on different
+    machines, and optionally write the total as a new count file. All files must have been
+    counted with the same pre-tokenization and corpus, which their metadata records, and shard
+    files must cover every shard of their split exactly once.
+    """
+    metadata = _check_count_files(paths, [load_counts_metadata(path) for path in paths])
+    word_counts = Counter()
+    for path in paths:
+        with np.load(path) as arrays:
+            merge_packed_counts(word_counts, arrays["data"], arrays["offsets"], arrays["counts"])
+
+    if output_path is not None:
+        save_counts(output_path, word_counts, metadata)
+    return word_counts
+
+
+def corpus_fingerprint(file_path: str | Path, include_mtime: bool = True) -> str:
+    """
+    Fingerprint a corpus from its size, modification time and evenly spaced samples of
+    its content, so that multi-GB files are not hashed in full on every run. Without the
+    modification time, copies of the same file on different machines fingerprint the same.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode() if include_mtime
+                            else f"{stat.st_size}".encode())
+    with open(file_path, "rb") as f:
+        if stat.st_size <= FINGERPRINT_SAMPLES * FINGERPRINT_SAMPLE_SIZE:
+            digest.update(f.read())
+        else:
+            stride = (stat.st_size - FINGERPRINT_SAMPLE_SIZE) // (FINGERPRINT_SAMPLES - 1)
+            for i in range(FINGERPRINT_SAMPLES):
+                f.seek(i * stride)
+                digest.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def counts_cache_path(cache_dir: str | Path,
+                      files: list[str | Path],
+                      special_tokens: list[str],
+                      pattern: str) -> Path:
+    key = json.dumps({
+        "version": COUNTS_FORMAT_VERSION,
+        "corpus": sorted(corpus_fingerprint(file_path) for file_path in files),
+        "special_tokens": special_tokens,
+        "pattern": pattern,
+    })
+    return Path(cache_dir) / f"pre_token_counts_{hashlib.sha256(key.encode()).hexdigest()[:32]}.npz"
@@ -1,50 +1,135 @@
+import io
+import mmap
 import os
 from typing import BinaryIO
 
+import regex as re
+
+INITIAL_SEARCH_WINDOW = 64 * 1024
+MAX_SEARCH_DISTANCE = 16 * 1024 * 1024
+WHITESPACE = re.compile(r"\s")
+
+
 def find_chunk_boundaries(
-    file: BinaryIO, 
-    desired_num_chunks: int, 
-    split_special_token: bytes
+    file: BinaryIO,
+    desired_num_chunks: int,
+    split_special_token: bytes | list[bytes],
+    max_search_distance: int | None = None,
+    exact: bool = False,
 ) -> list[int]:
     """
     Chunk the file into parts that can be counted independently.
     May return fewer chunks if the boundaries end up overlapping.
+
+    Each boundary moves forward from its uniform guess to the nearest occurrence of any of
+    the split tokens. If none occurs within max_search_distance (by default a sixteenth of
+    a chunk, at most 16MB), it falls back to the nearest newline, then to the nearest space,
+    and finally to the nearest UTF-8 character boundary, so a corpus without delimiters
+    still gets balanced chunks. Whitespace boundaries split the pre-tokens exactly like the
+    unchunked text does, only the last fallback may not. With exact=True it is never used:
+    a boundary with no delimiter or whitespace in reach moves on to the next one, however far.
     """
-    assert isinstance(split_special_token, bytes), (
-        "Must represent special token as a bytestring"
+    split_tokens = [split_special_token] if isinstance(split_special_token, bytes) else list(split_special_token)
+    assert all(isinstance(token, bytes) and token for token in split_tokens), (
+        "Must represent special tokens as non-empty bytestrings"
     )
 
     # Get total file size in bytes
     file.seek(0, os.SEEK_END)
     file_size = file.tell()
     file.seek(0)
+    if file_size == 0:
+        return [0]
 
     chunk_size = file_size // desired_num_chunks
+    if max_search_distance is None:
+        max_search_distance = max(min(chunk_size // 16, MAX_SEARCH_DISTANCE), INITIAL_SEARCH_WINDOW)
 
     # Initial guesses for chunk boundary locations, uniformly spaced
     # Chunks start on previous index, don't include last index
     chunk_boundaries = [i * chunk_size for i in range(desired_num_chunks + 1)]
     chunk_boundaries[-1] = file_size
 
-    mini_chunk_size = 4096  # Read ahead by 4k bytes at a time
-
-    for bi in range(1, len(chunk_boundaries) - 1):
-        initial_position = chunk_boundaries[bi]
-        file.seek(initial_position)  # Start at boundary guess
-        while True:
-            mini_chunk = file.read(mini_chunk_size)  # Read a mini chunk
+    try:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, io.UnsupportedOperation):
+        # In-memory files have no descriptor to map, bytes support the same find calls.
+        data = file.read()
 
-            # If EOF, this boundary should be at the end of the file
-            if mini_chunk == b"":
-                chunk_boundaries[bi] = file_size
-                break
-
-            # Find the special token in the mini chunk
-            found_at = mini_chunk.find(split_special_token)
-            if found_at != -1:
-                chunk_boundaries[bi] = initial_position + found_at
-                break
-            initial_position += mini_chunk_size
+    try:
+        for bi in range(1, len(chunk_boundaries) - 1):
+            chunk_boundaries[bi] = _find_boundary(data, chunk_boundaries[bi], file_size,
+                                                  split_tokens, max_search_distance, exact)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
 
     # Make sure all boundaries are unique, but might be fewer than desired_num_chunks
     return sorted(set(chunk_boundaries))
+
+
+def _find_first(data, tokens: list[bytes], start: int, end: int) -> int:
+    # Windows grow geometrically, so the scan costs the distance to the nearest match, not the bound.
+    window = INITIAL_SEARCH_WINDOW
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + window, end)
+        found = [data.find(token, window_start, min(window_end + len(token) - 1, end)) for token in tokens]
+        found = [position for position in found if position != -1]
+        if found:
+            return min(found)
+        window_start = window_end
+        window *= 2
+    return -1
+
+
+def _before_last_whitespace(data, position: int, file_size: int, split_tokens: list[bytes]) -> int:
+    # Before a non-space, pre-tokenization splits a whitespace run into all but its last character,
+    # then that last character, alone or as the leading space of the next word. Cutting right before
+    # it gives both chunks exactly those pre-tokens: "a\n\n\nb" -> "a\n\n" + "\nb".
+    # A run that ends at a special token stays whole, so the cut goes to the special token instead.
+    last = position
+    while position < file_size:
+        length = _char_length(data[position])
+        if not WHITESPACE.match(bytes(data[position:position + length]).decode("utf-8", errors="replace")):
+            break
+        last = position
+        position += length
+    if position == file_size or any(data[position:position + len(token)] == token for token in split_tokens):
+        return position
+    return last
+
+
+def _char_length(lead_byte: int) -> int:
+    if lead_byte < 0x80:
+        return 1
+    return 2 if lead_byte < 0xE0 else 3 if lead_byte < 0xF0 else 4
+
+
+def _find_boundary(data, position: int, file_size: int, split_tokens: list[bytes], max_search_distance: int,
+                   exact: bool = False) -> int:
+    end = min(position + max_search_distance, file_size)
+
+    if split_tokens:
+        found_at = _find_first(data, split_tokens, position, end)
+        if found_at != -1:
+            return found_at
+
+    for whitespace in (b"\n", b" "):
+        found_at = _find_first(data, [whitespace], position, end)
+        if found_at != -1:
+            return _before_last_whitespace(data, found_at, file_size, split_tokens)
+
+    if exact:
+        # The chunk runs on to whichever delimiter or whitespace comes first, or to the end of the file.
+        found_at = _find_first(data, split_tokens + [b"\n", b" "], end, file_size)
+        if found_at == -1:
+            return file_size
+        if any(data[found_at:found_at + len(token)] == token for token in split_tokens):
+            return found_at
+        return _before_last_whitespace(data, found_at, file_size, split_tokens)
+
+    # Never split inside a multibyte character: continuation bytes look like 0b10xxxxxx.
+    while position < file_size and data[position] & 0xC0 == 0x80:
+        position += 1
+    return position
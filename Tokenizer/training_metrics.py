@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+if sys.platform != "win32":
+    import resource
+
+
+def current_rss_bytes() -> int:
+    # /proc gives the current resident set on Linux, elsewhere the peak is the closest stdlib figure.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if sys.platform == "win32":
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class TrainingMetrics:
+    """
+    Opt-in telemetry for train_bpe. Every event is a flat dict with an "event" name and a
+    "time" stamp, appended as one JSON line to `path` and/or passed to `callback`.
+    With neither set, events are dropped, so training can always report into one.
+    """
+
+    def __init__(self,
+                 path: str | Path | None = None,
+                 callback=None,
+                 merge_report_every: int = 100):
+        self.callback = callback
+        self.merge_report_every = merge_report_every
+        self.file = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(path, "a", encoding="utf-8")
+
+    @property
+    def enabled(self) -> bool:
+        return self.file is not None or self.callback is not None
+
+    def emit(self, event: str, **fields):
+        if not self.enabled:
+            return
+        record = {"event": event, "time": time.time(), **fields}
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+        if self.callback is not None:
+            self.callback(record)
+
+    @contextmanager
+    def phase(self, name: str, **fields):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit("phase", phase=name, seconds=time.perf_counter() - start,
+                      rss_bytes=current_rss_bytes() if self.enabled else 0, **fields)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MergeProgress:
+    """Aggregates merge-loop statistics and reports them every `metrics.merge_report_every` merges."""
+
+    def __init__(self, metrics: TrainingMetrics):
+        self.metrics = metrics
+        self.window_start = time.perf_counter()
+        self.window_merges = 0
+        self.window_affected_words = 0
+        self.window_max_affected_words = 0
+
+    def update(self, num_merges: int, affected_words: int, live_pairs: int, batch_merges: int = 1):
+        if not self.metrics.enabled:
+            return
+        self.window_merges += batch_merges
+        self.window_affected_words += affected_words
+        self.window_max_affected_words = max(self.window_max_affected_words, affected_words)
+        if self.window_merges >= self.metrics.merge_report_every:
+            self.flush(num_merges, live_pairs)
+
+    def flush(self, num_merges: int, live_pairs: int):
+        if not self.window_merges:
+            return
+        now = time.perf_counter()
+        elapsed = now - self.window_start
+        self.metrics.emit(
+            "merges",
+            merges=num_merges,
+            window_merges=self.window_merges,
+            merges_per_second=self.window_merges / elapsed if elapsed > 0 else None,
+            live_pairs=live_pairs,
+            affected_words=self.window_affected_words,
+            max_affected_words=self.window_max_affected_words,
+            rss_bytes=current_rss_bytes(),
+        )
+        self.window_start = now
+        self.window_merges = 0
+        self.window_affected_words = 0
+        self.window_max_affected_words = 0
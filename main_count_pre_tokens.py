@@ -0,0 +1,45 @@
+import argparse
+from pathlib import Path
+from Tokenizer.BPE_Tokenizer_Optimized import count_shard
+from Tokenizer.pre_token_counts import merge_count_files
+from Tokenizer.training_metrics import TrainingMetrics
+
+# Pre-tokenization across machines sharing a filesystem:
+#   every machine i of N:  python main_count_pre_tokens.py count --path corpus/ --shard_index i --num_shards N
+#                                 --output_path counts/shard_i.npz
+#   then once:             python main_count_pre_tokens.py merge-counts --inputs counts/*.npz --output_path counts.npz
+#                          python main_train_bpe.py --counts_path counts.npz ...
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser(description="Distributed pre-token counting for BPE training")
+    commands = parse.add_subparsers(dest="command", required=True)
+
+    count = commands.add_parser("count", help="Count the pre-tokens of one shard of the corpus")
+    count.add_argument("--path", type=str, nargs="+", required=True, help="Corpus files or directories of shards")
+    count.add_argument("--output_path", type=str, required=True, help="Count file to write")
+    count.add_argument("--shard_index", type=int, default=0, help="Shard counted by this machine")
+    count.add_argument("--num_shards", type=int, default=1, help="Number of machines the corpus is split across")
+    count.add_argument("--chunk_size_mb", type=int, default=10,
+                       help="Target size of a pre-tokenization chunk, must be the same on every machine")
+    count.add_argument("--num_workers", type=int, default=None, help="Pre-tokenization processes, all cores by default")
+    count.add_argument("--metrics_path", type=str, default=None, help="JSONL file for phase timings")
+
+    merge = commands.add_parser("merge-counts", help="Sum count files into one")
+    merge.add_argument("--inputs", type=str, nargs="+", required=True, help="Count files to merge")
+    merge.add_argument("--output_path", type=str, required=True, help="Merged count file to write")
+
+    args = parse.parse_args()
+    special_tokens = ["<|endoftext|>"]
+
+    if args.command == "count":
+        with TrainingMetrics(args.metrics_path) as metrics:
+            word_counts = count_shard([Path(p) for p in args.path], args.output_path, special_tokens,
+                                      shard_index=args.shard_index, num_shards=args.num_shards,
+                                      chunk_size=args.chunk_size_mb * 1024 * 1024,
+                                      num_workers=args.num_workers, metrics=metrics)
+    else:
+        try:
+            word_counts = merge_count_files(args.inputs, args.output_path)
+        except ValueError as e:
+            parse.error(str(e))
+
+    print(f"\n{len(word_counts)} distinct pre-tokens written to {args.output_path}")
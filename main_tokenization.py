@@ -2,49 +2,71 @@ import argparse
 import time
 from pathlib import Path
 import numpy as np
-import tempfile
+import multiprocessing as mp
 
 from Experiments.utils import log_stats
+import Tokenizer.Tokenizer as tokenizer_module
+from Tokenizer.BPE_Tokenizer_Optimized import bounded_imap
+from Tokenizer.pre_tokenization_chunks import find_chunk_boundaries
 from tests.test_tokenizer import get_tokenizer_from_vocab_merges_path
 import os
 
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+def encode_chunk(file_path, start, end):
+    # Workers are started with the Tokenizer module's initializer, the same as encode_batch's pool.
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+    return tokenizer_module._worker_tokenizer.encode_to_array(text)
+
+
+def _shrink_npy(output_path, header_size, dtype, length):
+    # The header was written for the capacity. It is rewritten for the real length, padded to the
+    # same size so the data stays where it is, and the unused tail of the file is cut off.
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                   "shape": (length,)})
+    with open(output_path, "r+b") as f:
+        major, _ = np.lib.format.read_magic(f)
+        header_start = f.tell() + (2 if major == 1 else 4)
+        f.seek(header_start)
+        f.write((header + " " * (header_size - header_start - len(header) - 1) + "\n").encode("latin1"))
+        f.truncate(header_size + length * np.dtype(dtype).itemsize)
+
+
+def tokenize_file(file_path, output_path, tokenizer, num_workers=None, chunk_size=DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Encode a text file into a .npy array of token ids and return the number of tokens.
+    The file is split on special tokens, or where none is near on whitespace, into chunks that
+    a pool of workers encodes. Each chunk's ids are written in order straight into their place in
+    the output memmap, and they are the same ids as encoding the whole file at once.
+    The file is decoded as is, without newline translation, so CRLF line breaks stay CRLF.
+    Ids are stored as tokenizer.token_dtype, uint16 or uint32 depending on the vocabulary size.
+    """
+    dtype = tokenizer.token_dtype
+    num_workers = num_workers or mp.cpu_count()
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        boundaries = find_chunk_boundaries(f, file_size // chunk_size + 1,
+                                           [token.encode("utf-8") for token in tokenizer.special_tokens],
+                                           exact=True)
+
+    # Every token covers at least one byte of the file, so the file size bounds the token count.
+    # Pages past the last written token are never touched and are truncated away at the end.
+    output = np.lib.format.open_memmap(output_path, "w+", dtype, (max(file_size, 1),))
+    header_size = output.offset
+    position = 0
+    with mp.Pool(num_workers, initializer=tokenizer_module._init_worker, initargs=(tokenizer,)) as pool:
+        chunks = ((file_path, start, end) for start, end in zip(boundaries[:-1], boundaries[1:]))
+        for ids in bounded_imap(pool, encode_chunk, chunks, 2 * num_workers):
+            output[position:position + len(ids)] = ids
+            position += len(ids)
+    output.flush()
+    del output
+
+    _shrink_npy(output_path, header_size, dtype, position)
+    return position
 
-def process_chunk_tokens(file_path, output_path, tokenizer , chunk_size = 250_000_000):
-
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_dir = Path(temp_dir)
-        temp_files = []
-        buffer_tokens = np.empty(chunk_size, dtype=np.uint16)
-        buffer_idx = 0
-        size = 0
-        with (open(file_path, "r", encoding="utf-8") as f):
-            for _id in tokenizer.encode_iterable(f):
-                buffer_tokens[buffer_idx] = _id
-                buffer_idx += 1
-                if buffer_idx == chunk_size:
-                    temp_file = temp_dir / f"temp_file_{len(temp_files)}.npy"
-                    temp_files.append(temp_file)
-                    np.save(temp_file, buffer_tokens)
-                    size += chunk_size
-                    buffer_idx = 0
-        if buffer_idx > 0:
-            temp_file = temp_dir / f"temp_file_{len(temp_files)}.npy"
-            temp_files.append(temp_file)
-            np.save(temp_file, buffer_tokens[:buffer_idx])
-            size += buffer_idx
-
-        final_array = np.lib.format.open_memmap(
-            output_path,
-            "w+",
-            np.uint16,
-            (size, )
-        )
-        current_pos = 0
-        for file in temp_files:
-            chunk = np.load(file)
-            len_chunk = len(chunk)
-            final_array[current_pos: current_pos + len_chunk] = chunk
-            current_pos += len_chunk
 
 if __name__ == "__main__":
     import pstats
@@ -53,29 +75,37 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Script for running tokenization")
 
     parser.add_argument("--tokenizer_path", type=str,required=True , help="Path for directory that contains merges and vocab")
-    parser.add_argument("--eval_path", type=str,required=True , help="Path for directory that contains merges and vocab")
+    parser.add_argument("--eval_path", type=str,required=True ,
+                        help="Path of the text file to tokenize, decoded without newline translation, CRLF stays CRLF")
+    parser.add_argument("--output_path", type=str, default=None,
+                        help="Token ids .npy to write, tokenized_test.npy in the tokenizer directory by default")
+    parser.add_argument("--num_workers", type=int, default=None, help="Encoding processes, all cores by default")
+    parser.add_argument("--chunk_size_mb", type=int, default=16, help="Target size of a chunk encoded by one worker")
+    parser.add_argument("--profile", action="store_true", help="Profile the main process and print the top calls")
 
     args = parser.parse_args()
     path_tokenizer = Path(args.tokenizer_path)
 
     special_tokens = ["<|endoftext|>"]
     tokenizer = get_tokenizer_from_vocab_merges_path(path_tokenizer / "train_bpe_vocab.json", path_tokenizer / "train_bpe_merges.txt", special_tokens)
-    token_id_list = []
 
     file_path = Path(args.eval_path)
     file_size_bytes = os.path.getsize(file_path)
 
-
-    output_path = path_tokenizer / "tokenized_test.npy"
+    output_path = Path(args.output_path) if args.output_path else path_tokenizer / "tokenized_test.npy"
 
     print("Starting Tokenization")
     start_time = time.time()
 
-    with cProfile.Profile() as pr:
-        process_chunk_tokens(file_path, output_path, tokenizer)
+    profile = cProfile.Profile() if args.profile else None
+    if profile:
+        profile.enable()
+    num_tokens = tokenize_file(file_path, output_path, tokenizer, num_workers=args.num_workers,
+                               chunk_size=args.chunk_size_mb * 1024 * 1024)
+    if profile:
+        profile.disable()
+        pstats.Stats(profile).sort_stats("cumtime").print_stats(25)
     end_time = time.time()
-    stats = pstats.Stats(pr)
-    stats.sort_stats("cumtime").print_stats(25)
 
     # Compute and print throughput
     elapsed = end_time - start_time
@@ -83,10 +113,11 @@ if __name__ == "__main__":
 
     stats = {
         "elapsed_time": elapsed,
-        "throughput":throughput_bytes
+        "throughput":throughput_bytes,
+        "num_tokens": num_tokens,
     }
 
     print(f"Elapsed time: {elapsed:.2f} seconds")
     print(f"File size: {file_size_bytes / 1_000_000:.2f} MB")
+    print(f"Tokens: {num_tokens} written to {output_path}")
     print(f"Throughput: {throughput_bytes / 1_000_000:.2f} MB/sec ({throughput_bytes:.2f} bytes/sec)")
-    
\ No newline at end of file
@@ -1,7 +1,9 @@
 import argparse
 from pathlib import Path
 import  json
-from Tokenizer.BPE_Tokenizer_Optimized import train_bpe
+from Tokenizer.BPE_Tokenizer_Optimized import check_counts_metadata, train_bpe, train_bpe_from_counts, resume_train_bpe
+from Tokenizer.pre_token_counts import load_counts_metadata, merge_count_files
+from Tokenizer.training_metrics import TrainingMetrics
 from tests.common import gpt2_bytes_to_unicode
 
 
@@ -22,26 +24,133 @@ def save_bpe(output_path: Path, vocab: dict[int, bytes], merges: list[tuple[byte
             right = ''.join([byte_encoder[b] for b in right_bytes])
             f.write(f"{left} {right}\n")
 
+def print_event(event: dict):
+    # Training only reports through metrics, this echoes every record to the console.
+    fields = ", ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                       for key, value in event.items() if key not in ("event", "time"))
+    print(f"{event['event']}: {fields}")
+
+
+def load_bpe(input_path: Path) -> tuple[dict[int, bytes], list[tuple[bytes, bytes]]]:
+    byte_decoder = {v: k for k, v in gpt2_bytes_to_unicode().items()}
+
+    with open(input_path / "train_bpe_vocab.json", encoding="utf-8") as f:
+        vocab_json = json.load(f)
+    vocab = {token_id: bytes([byte_decoder[c] for c in token_str]) for token_str, token_id in vocab_json.items()}
+
+    merges = []
+    with open(input_path / "train_bpe_merges.txt", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split(" ")
+            if len(parts) == 2:
+                left, right = parts
+                merges.append((bytes([byte_decoder[c] for c in left]), bytes([byte_decoder[c] for c in right])))
+    return vocab, merges
+
 if __name__ == "__main__":
     import pstats
     import cProfile
 
     parse = argparse.ArgumentParser(description="Training script for BPE Tokenizer")
-    parse.add_argument("--path", type=str, required=True,  help="Path to base directory")
-    parse.add_argument("--vocab_size", type=int, required=True, help="vocabulary size")
+    corpus = parse.add_mutually_exclusive_group(required=True)
+    corpus.add_argument("--path", type=str, nargs="+", help="Corpus files or directories of shards")
+    corpus.add_argument("--counts_path", type=str, nargs="+",
+                        help="Count files from main_count_pre_tokens.py to train from instead of a corpus")
+    parse.add_argument("--vocab_size", type=int, nargs="+", required=True,
+                       help="vocabulary size, several sizes are trained in a single run")
     parse.add_argument("--output_path", type=str, required=True, help="output_path")
+    parse.add_argument("--cache_dir", type=str, default=None,
+                       help="Directory for cached pre-token counts, reused by later runs on the same corpus")
+    parse.add_argument("--chunk_size_mb", type=int, default=10, help="Target size of a pre-tokenization chunk")
+    parse.add_argument("--num_workers", type=int, default=None, help="Pre-tokenization processes, all cores by default")
+    parse.add_argument("--checkpoint_path", type=str, default=None, help="File for periodic merge-loop checkpoints")
+    parse.add_argument("--checkpoint_every", type=int, default=1000, help="Number of merges between checkpoints")
+    parse.add_argument("--resume", action="store_true", help="Continue from --checkpoint_path if it exists")
+    parse.add_argument("--metrics_path", type=str, default=None,
+                       help="JSONL file for phase timings and merge-loop progress")
+    parse.add_argument("--metrics_every", type=int, default=100, help="Number of merges per progress record")
+    parse.add_argument("--quiet", action="store_true", help="Do not print progress to the console")
+    parse.add_argument("--profile", action="store_true", help="Run the training under cProfile")
+    parse.add_argument("--base_tokenizer", type=str, default=None,
+                       help="Directory with a vocab/merges pair to extend instead of training from bytes")
+    parse.add_argument("--min_word_freq", type=int, default=1, help="Leave out pre-tokens seen fewer times")
+    parse.add_argument("--max_words", type=int, default=None, help="Train on at most this many distinct pre-tokens")
+    parse.add_argument("--merge_batch_size", type=int, default=1,
+                       help="Merges applied per step, above 1 the merge order is only approximately exact")
+    parse.add_argument("--compare_exact", action="store_true",
+                       help="With --merge_batch_size, also train exactly and report how the merges differ")
+    parse.add_argument("--merge_workers", type=int, default=1,
+                       help="Processes the word table is sharded across during the merge loop")
 
     args = parse.parse_args()
-    path = Path(args.path)
+    path = [Path(p) for p in args.path] if args.path else None
 
     output_path = Path(args.output_path)
     Path.mkdir(output_path, parents=True, exist_ok=True)
     special_tokens = ["<|endoftext|>"]
 
-    with cProfile.Profile() as pr:
-        _vocab, _merges = train_bpe(path, args.vocab_size, special_tokens)
+    if args.counts_path:
+        # merge_count_files makes sure every file agrees, so checking the first one covers them all.
+        try:
+            check_counts_metadata(load_counts_metadata(args.counts_path[0]), special_tokens)
+        except ValueError as e:
+            parse.error(f"{args.counts_path[0]}: {e}")
+
+    base_vocab, base_merges = None, None
+    if args.base_tokenizer:
+        base_vocab, base_merges = load_bpe(Path(args.base_tokenizer))
+
+    # With several sizes every vocab/merges pair goes to its own sub-directory as the merge loop reaches it.
+    on_snapshot = None
+    if len(args.vocab_size) > 1:
+        def on_snapshot(size, vocab, merges):
+            snapshot_path = output_path / f"vocab_{size}"
+            Path.mkdir(snapshot_path, parents=True, exist_ok=True)
+            save_bpe(snapshot_path, vocab, merges)
+
+    metrics = TrainingMetrics(args.metrics_path, callback=None if args.quiet else print_event,
+                              merge_report_every=args.metrics_every)
+    pr = cProfile.Profile() if args.profile else None
+    if pr is not None:
+        pr.enable()
+
+    with metrics:
+        if args.resume and args.checkpoint_path and Path(args.checkpoint_path).exists():
+            _vocab, _merges = resume_train_bpe(args.checkpoint_path, args.vocab_size,
+                                               on_snapshot=on_snapshot, checkpoint_every=args.checkpoint_every,
+                                               metrics=metrics, merge_batch_size=args.merge_batch_size,
+                                               merge_workers=args.merge_workers)
+        elif args.counts_path:
+            _vocab, _merges = train_bpe_from_counts(merge_count_files(args.counts_path), args.vocab_size,
+                                                    special_tokens, on_snapshot=on_snapshot,
+                                                    checkpoint_path=args.checkpoint_path,
+                                                    checkpoint_every=args.checkpoint_every,
+                                                    base_vocab=base_vocab, base_merges=base_merges,
+                                                    metrics=metrics,
+                                                    min_word_freq=args.min_word_freq,
+                                                    max_words=args.max_words,
+                                                    merge_batch_size=args.merge_batch_size,
+                                                    compare_exact=args.compare_exact,
+                                                    merge_workers=args.merge_workers)
+        else:
+            _vocab, _merges = train_bpe(path, args.vocab_size, special_tokens,
+                                        cache_dir=args.cache_dir, on_snapshot=on_snapshot,
+                                        checkpoint_path=args.checkpoint_path,
+                                        checkpoint_every=args.checkpoint_every,
+                                        base_vocab=base_vocab, base_merges=base_merges,
+                                        chunk_size=args.chunk_size_mb * 1024 * 1024,
+                                        num_workers=args.num_workers,
+                                        metrics=metrics,
+                                        min_word_freq=args.min_word_freq,
+                                        max_words=args.max_words,
+                                        merge_batch_size=args.merge_batch_size,
+                                        compare_exact=args.compare_exact,
+                                        merge_workers=args.merge_workers)
 
-    stats = pstats.Stats(pr)
-    stats.sort_stats("cumtime").print_stats(25)
+    if pr is not None:
+        pr.disable()
+        stats = pstats.Stats(pr)
+        stats.sort_stats("cumtime").print_stats(25)
 
-    save_bpe(output_path, _vocab, _merges)
\ No newline at end of file
+    if on_snapshot is None:
+        save_bpe(output_path, _vocab, _merges)
\ No newline at end of file
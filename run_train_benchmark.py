@@ -0,0 +1,50 @@
+from pathlib import Path
+import argparse
+import json
+import time
+from Experiments.train_benchmark import (FIXTURE_CORPORA, compare_with_baseline, run_benchmarks, save_benchmark,
+                                         synthetic_corpus)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BPE training")
+    parser.add_argument("--vocab_size", type=int, default=1000, help="Target vocabulary size")
+    parser.add_argument("--synthetic_sizes_mb", type=int, nargs="*", default=[10, 100, 1000],
+                        help="Sizes of the synthetic corpora in MB, none to only run the fixtures")
+    parser.add_argument("--data_dir", type=str, default="data/benchmark_corpora",
+                        help="Where the synthetic corpora are generated once and reused")
+    parser.add_argument("--trainers", type=str, nargs="+", default=["optimized", "unoptimized"],
+                        choices=["optimized", "unoptimized"])
+    parser.add_argument("--unoptimized_max_mb", type=float, default=1.0,
+                        help="Skip the unoptimized trainer on corpora larger than this")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per corpus and trainer, the fastest is compared")
+    parser.add_argument("--num_workers", type=int, default=None, help="Pre-tokenization processes")
+    parser.add_argument("--label", type=str, default=None, help="Name of the results directory, a timestamp by default")
+    parser.add_argument("--baseline", type=str, default=None, help="stats.json of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown or RSS growth before flagging")
+
+    args = parser.parse_args()
+
+    corpora = dict(FIXTURE_CORPORA)
+    for size_mb in args.synthetic_sizes_mb:
+        corpora[f"synthetic_{size_mb}mb"] = synthetic_corpus(Path(args.data_dir) / f"synthetic_{size_mb}mb.txt",
+                                                             size_mb * 1024 * 1024)
+
+    results = run_benchmarks(corpora, args.vocab_size, ["<|endoftext|>"],
+                             trainers=args.trainers,
+                             unoptimized_max_bytes=int(args.unoptimized_max_mb * 1024 * 1024),
+                             repeats=args.repeats,
+                             num_workers=args.num_workers)
+
+    comparisons = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparisons = compare_with_baseline(results, json.load(f)["results"], args.tolerance)
+        for comparison in comparisons:
+            print(f"{comparison['corpus']:>24} {comparison['trainer']:>12}: "
+                  f"time x{comparison['time_ratio']:.2f}  RSS x{comparison['rss_ratio']:.2f}"
+                  + ("  merges changed" if comparison["merges_changed"] else "")
+                  + ("  REGRESSION" if comparison["regression"] else ""))
+
+    output_path = Path("Experiments/Results/train_benchmark") / (args.label or time.strftime("%Y%m%d-%H%M%S"))
+    save_benchmark(results, output_path, comparisons)
+    print(f"Results saved to {output_path / 'stats.json'}")
@@ -61,4 +61,4 @@ def run_train_bpe(
             representing that <token1> was merged with <token2>.
                 Merges are ordered by order of creation.
     """
-    return train_bpe(input_path, vocab_size, special_tokens)
\ No newline at end of file
+    return train_bpe(input_path, vocab_size, special_tokens, **kwargs)
\ No newline at end of file
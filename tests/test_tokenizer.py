@@ -4,6 +4,7 @@ import json
 import os
 import sys
 
+import numpy as np
 import psutil
 import pytest
 import tiktoken
@@ -461,6 +462,28 @@ def test_encode_iterable_tinystories_matches_tiktoken():
     assert reference_tokenizer.decode(reference_ids) == corpus_contents
 
 
+def test_encode_long_pre_tokens_match_rescanning_merges():
+    tokenizer = get_tokenizer_from_vocab_merges_path(
+        vocab_path=VOCAB_PATH,
+        merges_path=MERGES_PATH,
+    )
+    merge_priority = {pair: rank for rank, pair in enumerate(tokenizer.merges)}
+    reverse_vocab = {token: token_id for token_id, token in tokenizer.vocab.items()}
+
+    def rescanning_encode(pre_token):
+        # Reference BPE: rescan every pair and merge the lowest-ranked, leftmost one.
+        tokens = [bytes([b]) for b in pre_token.encode("utf-8")]
+        while True:
+            ranks = [merge_priority.get(pair, float("inf")) for pair in zip(tokens[:-1], tokens[1:])]
+            if not ranks or min(ranks) == float("inf"):
+                return [reverse_vocab[token] for token in tokens]
+            i = ranks.index(min(ranks))
+            tokens[i:i + 2] = [tokens[i] + tokens[i + 1]]
+
+    for pre_token in ["1234567890" * 100, " " * 2000, "a" * 1000, "=" * 777, "ÿ" * 300]:
+        assert tokenizer.encode(pre_token) == rescanning_encode(pre_token)
+
+
 @pytest.mark.skipif(
     not sys.platform.startswith("linux"),
     reason="rlimit support for non-linux systems is spotty.",
@@ -510,3 +533,88 @@ def _encode(tokenizer, text):
     for just this function. We set the memory limit to 1MB.
     """
     return tokenizer.encode(text)
+
+
+def test_encode_batch_matches_encode():
+    tokenizer = get_tokenizer_from_vocab_merges_path(
+        vocab_path=VOCAB_PATH,
+        merges_path=MERGES_PATH,
+        special_tokens=["<|endoftext|>"],
+    )
+    with open(FIXTURES_PATH / "tinystories_sample.txt", encoding="utf-8") as f:
+        texts = f.read().split("\n") * 3
+    expected = [tokenizer.encode(text) for text in texts]
+
+    with tokenizer:
+        assert tokenizer.encode_batch(texts, num_workers=2) == expected
+        ids, offsets = tokenizer.encode_batch(texts, num_workers=2, flat=True)
+        assert [ids[offsets[i]:offsets[i + 1]].tolist() for i in range(len(texts))] == expected
+        assert tokenizer.encode_batch([], num_workers=2, flat=True)[1].tolist() == [0]
+
+
+def test_tokenize_file_matches_encode(tmp_path):
+    from main_tokenization import tokenize_file
+
+    tokenizer = get_tokenizer_from_vocab_merges_path(
+        vocab_path=VOCAB_PATH,
+        merges_path=MERGES_PATH,
+        special_tokens=["<|endoftext|>"],
+    )
+    file_path = FIXTURES_PATH / "tinystories_sample.txt"
+    # Files are encoded byte for byte, a text-mode read would translate newlines.
+    expected = tokenizer.encode(file_path.read_bytes().decode("utf-8"))
+
+    output_path = tmp_path / "tokens.npy"
+    assert tokenize_file(file_path, output_path, tokenizer, num_workers=2, chunk_size=1024) == len(expected)
+    assert np.load(output_path).tolist() == expected
+    assert np.load(output_path, mmap_mode="r").tolist() == expected
+
+
+def test_encode_to_array_matches_encode():
+    tokenizer = get_tokenizer_from_vocab_merges_path(
+        vocab_path=VOCAB_PATH,
+        merges_path=MERGES_PATH,
+        special_tokens=["<|endoftext|>"],
+    )
+    with open(FIXTURES_PATH / "tinystories_sample.txt", encoding="utf-8") as f:
+        lines = f.readlines()
+    expected = [token_id for line in lines for token_id in tokenizer.encode(line)]
+
+    ids = tokenizer.encode_iterable_to_array(lines)
+    assert ids.dtype == np.uint16 and ids.tolist() == expected
+    assert tokenizer.encode_to_array("".join(lines)).tolist() == tokenizer.encode("".join(lines))
+    assert tokenizer.encode_iterable_to_array([]).tolist() == []
+
+    out = np.zeros(len(expected) + 10, dtype=np.uint16)
+    assert tokenizer.encode_iterable_to_array(lines, out=out).tolist() == expected
+    with pytest.raises(ValueError):
+        tokenizer.encode_iterable_to_array(lines, out=out[:len(expected) - 1])
+
+    # Ids past 65535 do not fit in uint16.
+    vocab = {i: bytes([i]) for i in range(256)}
+    vocab[70_000] = b"ab"
+    wide_tokenizer = get_tokenizer(vocab, [(b"a", b"b")])
+    ids = wide_tokenizer.encode_to_array("abcab")
+    assert ids.dtype == np.uint32 and ids.tolist() == [70_000, ord("c"), 70_000]
+
+
+def test_tokenize_file_without_special_tokens_matches_encode(tmp_path):
+    from main_tokenization import tokenize_file
+
+    tokenizer = get_tokenizer_from_vocab_merges_path(
+        vocab_path=VOCAB_PATH,
+        merges_path=MERGES_PATH,
+        special_tokens=["<|endoftext|>"],
+    )
+    # Boundaries fall back to whitespace runs, and past runs longer than the search window to the next one.
+    texts = [
+        "Hello world.\n\nSecond  paragraph\n\n\nhere.\r\n\r\n" * 200,
+        "x" * 100_000 + " naïve" * 100 + "é" * 100_000 + "　\n end",
+        "CRLF line\r\nbreaks\r\n\r\nstay\r\n" * 200,
+    ]
+    for i, text in enumerate(texts):
+        file_path = tmp_path / f"text_{i}.txt"
+        file_path.write_bytes(text.encode("utf-8"))
+        output_path = tmp_path / f"tokens_{i}.npy"
+        tokenize_file(file_path, output_path, tokenizer, num_workers=2, chunk_size=512)
+        assert np.load(output_path).tolist() == tokenizer.encode(file_path.read_bytes().decode("utf-8"))
@@ -1,6 +1,15 @@
+import io
 import json
+import shutil
 import time
 
+import pytest
+
+from Tokenizer import BPE_Tokenizer_Optimized
+from Tokenizer.pre_token_counts import load_counts, load_counts_metadata, merge_count_files, save_counts
+from Tokenizer.pre_tokenization_chunks import find_chunk_boundaries
+from Tokenizer.training_metrics import TrainingMetrics
+
 from .adapters import run_train_bpe
 from .common import FIXTURES_PATH, gpt2_bytes_to_unicode
 
@@ -85,4 +94,320 @@ def test_train_bpe_special_tokens(snapshot):
             "vocab_values": set(vocab.values()),
             "merges": merges,
         },
-    )
\ No newline at end of file
+    )
+
+def test_train_bpe_pre_token_cache(tmp_path, monkeypatch):
+    input_path = FIXTURES_PATH / "corpus.en"
+    vocab, merges = run_train_bpe(
+        input_path=input_path,
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+        cache_dir=tmp_path,
+    )
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+
+    # A second run on the same corpus must be served from the cache alone.
+    def fail_count_pre_tokens(*args, **kwargs):
+        raise AssertionError("pre-tokenization should have been skipped")
+
+    monkeypatch.setattr(BPE_Tokenizer_Optimized, "count_pre_tokens", fail_count_pre_tokens)
+    cached_vocab, cached_merges = run_train_bpe(
+        input_path=input_path,
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+        cache_dir=tmp_path,
+    )
+    assert cached_merges == merges
+    assert cached_vocab == vocab
+
+
+def test_train_bpe_vocab_size_snapshots():
+    input_path = FIXTURES_PATH / "corpus.en"
+    snapshots = {}
+
+    def on_snapshot(size, vocab, merges):
+        snapshots[size] = (vocab, merges)
+
+    vocab, merges = run_train_bpe(
+        input_path=input_path,
+        vocab_size=[500, 300, 400],
+        special_tokens=["<|endoftext|>"],
+        on_snapshot=on_snapshot,
+    )
+    assert list(snapshots) == [300, 400, 500]
+    assert snapshots[500] == (vocab, merges)
+    for size in (300, 400):
+        assert snapshots[size] == run_train_bpe(
+            input_path=input_path,
+            vocab_size=size,
+            special_tokens=["<|endoftext|>"],
+        )
+
+
+def test_train_bpe_resume_from_checkpoint(tmp_path):
+    input_path = FIXTURES_PATH / "corpus.en"
+    checkpoint_path = tmp_path / "checkpoint.pkl"
+    reference_vocab, reference_merges = run_train_bpe(
+        input_path=input_path,
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+    )
+
+    # Stop part-way through, as a killed run would, then continue from the checkpoint.
+    run_train_bpe(
+        input_path=input_path,
+        vocab_size=400,
+        special_tokens=["<|endoftext|>"],
+        checkpoint_path=checkpoint_path,
+        checkpoint_every=50,
+    )
+    vocab, merges = BPE_Tokenizer_Optimized.resume_train_bpe(checkpoint_path, 500)
+    assert merges == reference_merges
+    assert vocab == reference_vocab
+
+
+def test_train_bpe_warm_start():
+    input_path = FIXTURES_PATH / "corpus.en"
+    base_vocab, base_merges = run_train_bpe(
+        input_path=input_path,
+        vocab_size=400,
+        special_tokens=["<|endoftext|>"],
+    )
+    reference_vocab, reference_merges = run_train_bpe(
+        input_path=input_path,
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+    )
+
+    vocab, merges = run_train_bpe(
+        input_path=input_path,
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+        base_vocab=base_vocab,
+        base_merges=base_merges,
+    )
+    assert all(vocab[token_id] == token for token_id, token in base_vocab.items())
+    assert merges == reference_merges
+    assert vocab == reference_vocab
+
+    # Sizes the base vocabulary already reaches are still emitted, like a cold run's.
+    snapshots = {}
+    run_train_bpe(
+        input_path=input_path,
+        vocab_size=[350, 400, 500],
+        special_tokens=["<|endoftext|>"],
+        base_vocab=base_vocab,
+        base_merges=base_merges,
+        on_snapshot=lambda size, vocab, merges: snapshots.setdefault(size, (vocab, merges)),
+    )
+    assert sorted(snapshots) == [350, 400, 500]
+    assert snapshots[400] == (base_vocab, base_merges)
+    assert snapshots[500] == (reference_vocab, reference_merges)
+
+
+def test_train_bpe_corpus_directory(tmp_path):
+    shard_dir = tmp_path / "shards"
+    (shard_dir / "nested").mkdir(parents=True)
+    shutil.copy(FIXTURES_PATH / "tinystories_sample.txt", shard_dir / "a.txt")
+    shutil.copy(FIXTURES_PATH / "tinystories_sample.txt", shard_dir / "nested" / "b.txt")
+    shutil.copy(FIXTURES_PATH / "german.txt", shard_dir / "c.txt")
+
+    story_counts = BPE_Tokenizer_Optimized.count_pre_tokens(FIXTURES_PATH / "tinystories_sample.txt", ["<|endoftext|>"])
+    german_counts = BPE_Tokenizer_Optimized.count_pre_tokens(FIXTURES_PATH / "german.txt", ["<|endoftext|>"])
+    expected_counts = story_counts + story_counts + german_counts
+    counts = BPE_Tokenizer_Optimized.count_pre_tokens(
+        shard_dir, ["<|endoftext|>"], chunk_size=1024, num_workers=2,
+    )
+    assert counts == expected_counts
+
+    vocab, merges = run_train_bpe(
+        input_path=[shard_dir / "a.txt", shard_dir / "nested", shard_dir / "c.txt"],
+        vocab_size=400,
+        special_tokens=["<|endoftext|>"],
+    )
+    assert (vocab, merges) == BPE_Tokenizer_Optimized.train_bpe_from_counts(expected_counts, 400, ["<|endoftext|>"])
+
+
+def test_find_chunk_boundaries_delimiters_and_fallback():
+    text = b"first doc<|endoftext|>second doc<|pad|>third doc" * 200
+    boundaries = find_chunk_boundaries(io.BytesIO(text), 8, [b"<|endoftext|>", b"<|pad|>"])
+    assert boundaries[0] == 0 and boundaries[-1] == len(text)
+    assert len(boundaries) == 9
+    assert all(text[b:].startswith((b"<|endoftext|>", b"<|pad|>")) for b in boundaries[1:-1])
+
+    # Without any delimiter the boundaries fall back to whitespace instead of collapsing to one chunk.
+    text = "naïve words without delimiters ".encode("utf-8") * 500
+    boundaries = find_chunk_boundaries(io.BytesIO(text), 8, [b"<|endoftext|>"])
+    assert len(boundaries) == 9
+    assert all(text[b:b + 1] == b" " for b in boundaries[1:-1])
+
+
+def test_train_bpe_metrics(tmp_path):
+    events = []
+    metrics_path = tmp_path / "metrics.jsonl"
+    with TrainingMetrics(metrics_path, callback=events.append, merge_report_every=50) as metrics:
+        _, merges = run_train_bpe(
+            input_path=FIXTURES_PATH / "corpus.en",
+            vocab_size=500,
+            special_tokens=["<|endoftext|>"],
+            metrics=metrics,
+        )
+
+    with open(metrics_path) as f:
+        assert [json.loads(line) for line in f] == events
+
+    phases = {event["phase"] for event in events if event["event"] == "phase"}
+    assert {"chunking", "pre_tokenization", "reduction", "pair_counting", "merging"} <= phases
+
+    progress = [event for event in events if event["event"] == "merges"]
+    assert sum(event["window_merges"] for event in progress) == len(merges)
+    assert progress[-1]["merges"] == len(merges)
+    assert all(event["rss_bytes"] > 0 for event in progress)
+
+
+def test_train_bpe_word_pruning():
+    counts = BPE_Tokenizer_Optimized.count_pre_tokens(FIXTURES_PATH / "corpus.en", ["<|endoftext|>"])
+    frequent = {word: count for word, count in counts.items() if count >= 3}
+    top = dict(sorted(frequent.items(), key=lambda item: (item[1], item[0]), reverse=True)[:500])
+
+    events = []
+    vocab, merges = run_train_bpe(
+        input_path=FIXTURES_PATH / "corpus.en",
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+        min_word_freq=3,
+        max_words=500,
+        metrics=TrainingMetrics(callback=events.append),
+    )
+    assert (vocab, merges) == BPE_Tokenizer_Optimized.train_bpe_from_counts(top, 500, ["<|endoftext|>"])
+
+    (pruning,) = [event for event in events if event["event"] == "pruning"]
+    assert pruning["kept_words"] == 500
+    assert pruning["dropped_words"] == len(counts) - 500 - (b"<|endoftext|>" in counts)
+    assert pruning["dropped_frequency"] == sum(counts.values()) - counts[b"<|endoftext|>"] - sum(top.values())
+
+
+def test_train_bpe_from_sharded_count_files(tmp_path):
+    shard_paths = [tmp_path / f"shard_{i}.npz" for i in range(3)]
+    for i, shard_path in enumerate(shard_paths):
+        BPE_Tokenizer_Optimized.count_shard(
+            FIXTURES_PATH / "corpus.en", shard_path, ["<|endoftext|>"],
+            shard_index=i, num_shards=3, chunk_size=16 * 1024, num_workers=2,
+        )
+    counts = merge_count_files(shard_paths, tmp_path / "merged.npz")
+    assert counts == BPE_Tokenizer_Optimized.count_pre_tokens(
+        FIXTURES_PATH / "corpus.en", ["<|endoftext|>"], chunk_size=16 * 1024,
+    )
+
+    vocab, merges = BPE_Tokenizer_Optimized.train_bpe_from_counts(
+        load_counts(tmp_path / "merged.npz"), 500, ["<|endoftext|>"],
+    )
+    assert (vocab, merges) == run_train_bpe(FIXTURES_PATH / "corpus.en", 500, ["<|endoftext|>"])
+
+    # Counts made with different special tokens do not add up to a meaningful total.
+    save_counts(tmp_path / "other.npz", counts, BPE_Tokenizer_Optimized.counts_metadata(["<|pad|>"]))
+    with pytest.raises(ValueError):
+        merge_count_files([shard_paths[0], tmp_path / "other.npz"])
+    with pytest.raises(ValueError):
+        BPE_Tokenizer_Optimized.check_counts_metadata(load_counts_metadata(tmp_path / "other.npz"),
+                                                      ["<|endoftext|>"])
+    BPE_Tokenizer_Optimized.check_counts_metadata(load_counts_metadata(tmp_path / "merged.npz"), ["<|endoftext|>"])
+
+    # A missing or duplicated shard, or a shard cut with another chunk size, would silently skew the total.
+    BPE_Tokenizer_Optimized.count_shard(FIXTURES_PATH / "corpus.en", tmp_path / "resized.npz", ["<|endoftext|>"],
+                                        shard_index=2, num_shards=3, chunk_size=8 * 1024, num_workers=2)
+    for paths in (shard_paths[:2], shard_paths + shard_paths[:1], shard_paths[:2] + [tmp_path / "resized.npz"]):
+        with pytest.raises(ValueError):
+            merge_count_files(paths)
+
+
+def test_count_pairs_matches_loop():
+    counts = BPE_Tokenizer_Optimized.count_pre_tokens(FIXTURES_PATH / "corpus.en", ["<|endoftext|>"])
+    # Token ids past 255 exercise the wider pair keys used after a warm start.
+    byte_ids = [b * 300 for b in range(256)]
+    for ids in (None, byte_ids):
+        tokens, offsets, word_freqs = BPE_Tokenizer_Optimized.build_word_table(counts, ["<|endoftext|>"], ids)
+        potential_merges, bigram_locations = BPE_Tokenizer_Optimized.count_pairs(tokens, offsets, word_freqs)
+
+        expected_merges, expected_locations = {}, {}
+        for word_id, word in enumerate(BPE_Tokenizer_Optimized.split_words(tokens, offsets)):
+            for pair in zip(word[:-1], word[1:]):
+                expected_merges[pair] = expected_merges.get(pair, 0) + word_freqs[word_id]
+                expected_locations.setdefault(pair, set()).add(word_id)
+        assert potential_merges == expected_merges
+        assert bigram_locations == expected_locations
+
+
+def test_train_bpe_batched_merges():
+    events = []
+    vocab, merges = run_train_bpe(
+        input_path=FIXTURES_PATH / "corpus.en",
+        vocab_size=[400, 500],
+        special_tokens=["<|endoftext|>"],
+        merge_batch_size=8,
+        compare_exact=True,
+        metrics=TrainingMetrics(callback=events.append),
+    )
+    exact_vocab, exact_merges = run_train_bpe(FIXTURES_PATH / "corpus.en", 500, ["<|endoftext|>"])
+    assert len(vocab) == 500 and len(merges) == len(exact_merges)
+    assert merges != exact_merges
+    # Every merge joins two tokens the vocabulary already had.
+    tokens = set(vocab.values())
+    assert all(left in tokens and right in tokens and left + right in tokens for left, right in merges)
+
+    (diff,) = [event for event in events if event["event"] == "merge_diff"]
+    assert diff == {"event": "merge_diff", "time": diff["time"], "merge_batch_size": 8,
+                    **BPE_Tokenizer_Optimized.merge_list_diff(exact_merges, merges)}
+    assert diff["common_prefix"] >= 1 and diff["shared_tokens"] > 0.8
+
+
+def test_train_bpe_from_iterator(tmp_path):
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        documents = f.read().split("\n\n")
+    corpus_path = tmp_path / "corpus.txt"
+    corpus_path.write_text("<|endoftext|>".join(documents), encoding="utf-8")
+
+    stream = (document.encode("utf-8") if i % 2 else document for i, document in enumerate(documents))
+    vocab, merges = BPE_Tokenizer_Optimized.train_bpe_from_iterator(
+        stream, 500, ["<|endoftext|>"], batch_size=4096, num_workers=2,
+    )
+    assert (vocab, merges) == run_train_bpe(corpus_path, 500, ["<|endoftext|>"])
+
+
+def test_train_bpe_sharded_merge_workers(tmp_path):
+    reference = run_train_bpe(FIXTURES_PATH / "corpus.en", 500, ["<|endoftext|>"])
+    checkpoint_path = tmp_path / "checkpoint.pkl"
+    assert run_train_bpe(FIXTURES_PATH / "corpus.en", 500, ["<|endoftext|>"],
+                         merge_workers=3, checkpoint_path=checkpoint_path, checkpoint_every=100) == reference
+
+    # The checkpoint gathered from the shards resumes like one written by a single process.
+    assert BPE_Tokenizer_Optimized.resume_train_bpe(checkpoint_path, 700, merge_workers=2) == \
+        run_train_bpe(FIXTURES_PATH / "corpus.en", 700, ["<|endoftext|>"])
+
+
+def test_token_ranks_order_like_bytes(monkeypatch):
+    reference = run_train_bpe(FIXTURES_PATH / "corpus.en", 500, ["<|endoftext|>"])
+    # With gaps this small nearly every new token respaces the labels of all the others.
+    monkeypatch.setattr(BPE_Tokenizer_Optimized.TokenRanks, "GAP", 2)
+    assert run_train_bpe(FIXTURES_PATH / "corpus.en", 500, ["<|endoftext|>"]) == reference
+
+    vocab, _ = reference
+    ranks = BPE_Tokenizer_Optimized.TokenRanks({token_id: vocab[token_id] for token_id in range(256)})
+    for token_id in range(256, len(vocab)):
+        ranks.add(token_id, vocab)
+    by_rank = sorted(vocab, key=lambda token_id: (ranks.rank[token_id], token_id))
+    assert by_rank == sorted(vocab, key=lambda token_id: (vocab[token_id], token_id))
+
+
+def test_find_chunk_boundaries_whitespace_keeps_pre_tokens():
+    from collections import Counter
+
+    text = "Hello world.\n\nSecond  paragraph\n\n\nhere.\r\n\r\n\n<|endoftext|> end \n".encode("utf-8") * 300
+    special_tokens = ["<|endoftext|>"]
+    boundaries = find_chunk_boundaries(io.BytesIO(text), 64, [token.encode() for token in special_tokens],
+                                       max_search_distance=16)
+    assert len(boundaries) > 32
+    chunked = Counter()
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        chunked.update(BPE_Tokenizer_Optimized.pre_tokenization(text[start:end].decode("utf-8"), special_tokens))
+    assert chunked == Counter(BPE_Tokenizer_Optimized.pre_tokenization(text.decode("utf-8"), special_tokens))